@@ -0,0 +1,433 @@
+# explore.py - reachable configurations of ssk1 statecharts
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# A configuration is the encoded state of the chart (see elab_state):
+# mach.nslot slots, each the id of the active leaf of the region at that
+# offset or 0.  Configurations are kept packed, one byte per slot (two if
+# an id is over 255), as strings: they are the keys of the visited dict.
+#
+# Steps, for each event label enabled in a configuration:
+#  * Each active leaf offers the transitions of TransitionIndex.lookup,
+#    innermost source first.  Guards are not evaluated: all transitions
+#    of a source are alternatives, and if they all have guards the next
+#    source out is tried too (and the leaf may also not move).
+#  * A transition to dst rewrites the slots of its scope region
+#    (ScopeIndex.trans from its source): the states on the way down to
+#    dst are entered, other regions at their initial states.  This is
+#    fixed per transition so it is kept as (beg, end, packed slots).
+#  * Leaves in orthogonal regions fire together, as in one UML step; a
+#    leaf whose slot is rewritten by a transition already taken, or whose
+#    transition would rewrite such slots, does not fire.  Leaves whose
+#    innermost source is deeper choose first (UML priority).
+# Completion transitions (no label) are taken as one more event.  History
+# is not followed: regions are entered at their initial state.
+
+import time
+import multiprocessing
+from array import array
+
+from ssk1 import chart_index, trans_index, scope_index, elab_state
+from visited import VisitedTable
+
+class Explorer:
+    """
+    Usage:
+      ex = Explorer(mach)
+      ex.run()                          # breadth first from initial state
+      ex.configs[i]                     # packed configuration i
+      ex.unpack(ex.configs[i])          # tuple of slots
+      for i, step, j in ex.edges(): ...    # step: tuple of transitions
+    """
+
+    def __init__(self, mach, maxconf=None):
+        self.mach = mach
+        self.maxconf = maxconf          # stop after this many, if given
+        self.cindex = ci = chart_index(mach)
+        self.tindex = trans_index(mach)
+        self.sindex = scope_index(mach)
+        if mach.maxid > 255: self.typecode = 'H'
+        else: self.typecode = 'B'
+        self.width = array(self.typecode).itemsize  # bytes per slot
+        self.tnum = {}                  # Transition => index in mach.trans
+        for i in range(len(mach.trans)):
+            self.tnum[mach.trans[i]] = i
+        self.moves = {}                 # leaf id => label => options
+        self.configs = []               # packed, in BFS order
+        self.index = {}                 # packed => index in configs
+        self.esrc = array('i')          # edges: config index,
+        self.estep = array('i')         #   index in steps,
+        self.edst = array('i')          #   config index
+        self.steps = []                 # tuples of transition indices
+        self.stepnum = {}
+        self.done = 0                   # configs expanded so far
+        self.elapsed = 0.0              # seconds in run()
+        self.t0 = None
+
+    def pack(self, enc):
+        return array(self.typecode, enc).tostring()
+
+    def unpack(self, key):
+        enc = array(self.typecode)
+        enc.fromstring(key)
+        return tuple(enc)
+
+    def initial(self):
+        mach = self.mach
+        return self.pack([e or 0 for e in elab_state(mach, mach.root)])
+
+    def add(self, key):
+        "Return index of configuration key, adding it if new."
+        ix = self.index.get(key)
+        if ix == None:
+            ix = len(self.configs)
+            self.index[key] = ix
+            self.configs.append(key)
+        return ix
+
+    def enter(self, trans):
+        """
+        Return (beg, end, packed slots) for taking trans: the slots of
+        its scope region, from the source state (not the leaf: from a
+        composite to a state in it, the composite is left and entered).
+        """
+        ci = self.cindex
+        r, exits, entries = self.sindex.trans(trans.source, trans.target)
+        if r == None:
+            beg = 0; end = self.mach.nslot
+        else:
+            beg = r.offset; end = r.offset + r.nslot
+        enc = (end - beg)*[0]
+        nums = [ci.num[s] for s in entries]
+        stack = [(nums[0], 0)]          # (state number, index in entries)
+        while stack:
+            n, k = stack.pop()
+            if ci.leaf[n]:
+                enc[ci.roffset[ci.preg[n]] - beg] = ci.id[n]
+                continue
+            for rr in ci.regions(n):
+                if 0 <= k < len(nums) - 1 and ci.preg[nums[k+1]] == rr:
+                    stack.append((nums[k+1], k+1))
+                else:
+                    stack.append((ci.initial[rr], -1))
+        return (beg, end, self.pack(enc))
+
+    def leaf_moves(self, id):
+        """
+        Return dict label => (options, may_stay, level) for leaf id,
+        options a list of (beg, end, packed slots, (transition index,)),
+        beg and end byte offsets into packed configurations, level that
+        of the innermost source.
+        """
+        moves = self.moves.get(id)
+        if moves != None: return moves
+        w = self.width
+        moves = {}
+        for label, ts in self.tindex.enabled(id).items():
+            opts = []
+            may_stay = True
+            src = None
+            for t in ts:
+                if src != None and t.source is not src:
+                    if not may_stay: break   # outer source can't fire
+                src = t.source
+                if not t.guard: may_stay = False
+                beg, end, pat = self.enter(t)
+                opts.append((beg*w, end*w, pat, (self.tnum[t],)))
+            moves[label] = (opts, may_stay, -ts[0].source.level)
+        self.moves[id] = moves
+        return moves
+
+    def successors(self, key):
+        """
+        Return list of (step, packed) for configuration key, step a tuple
+        of transition indices.
+        """
+        enc = self.unpack(key)
+        w = self.width
+        bylabel = {}                    # label => [(slot, opts, ...)]
+        for slot in range(len(enc)):
+            if enc[slot]:
+                for label, mv in self.leaf_moves(enc[slot]).iteritems():
+                    part = (slot*w,) + mv
+                    if bylabel.has_key(label): bylabel[label].append(part)
+                    else: bylabel[label] = [part]
+        res = {}
+        for parts in bylabel.itervalues():
+            if len(parts) == 1:
+                # one leaf: each option is a step
+                for beg, end, pat, step in parts[0][1]:
+                    res[(step, key[:beg] + pat + key[end:])] = 1
+            else:
+                # deeper sources first: they have priority (stable sort)
+                parts.sort(key=lambda p: p[3])
+                for chosen in self.choices(parts):
+                    res[self.apply(key, chosen)] = 1
+        return res.keys()
+
+    def choices(self, parts):
+        """
+        Return list of non-empty lists of options that fire together,
+        for leaves parts, list of (slot, opts, may_stay, -level).
+        """
+        res = []
+        nleaf = len(parts)
+        # choose an option (or none) per leaf, depth first
+        stack = [(0, ())]               # (leaf index, chosen options)
+        while stack:
+            k, chosen = stack.pop()
+            if k == nleaf:
+                if chosen: res.append(chosen)
+                continue
+            slot, opts, may_stay, lev = parts[k]
+            taken = False
+            for c in chosen:
+                if c[0] <= slot < c[1]: taken = True; break
+            if taken:
+                stack.append((k+1, chosen))
+                continue
+            nopt = 0
+            for opt in opts:
+                clash = False
+                for c in chosen:
+                    if opt[0] < c[1] and c[0] < opt[1]:
+                        clash = True; break
+                if clash: continue
+                stack.append((k+1, chosen + (opt,)))
+                nopt = nopt + 1
+            if may_stay or nopt == 0:
+                stack.append((k+1, chosen))
+        return res
+
+    def apply(self, key, chosen):
+        step = []
+        for beg, end, pat, tix in chosen:
+            key = key[:beg] + pat + key[end:]
+            step.extend(tix)
+        step.sort()
+        return tuple(step), key
+
+    def add_edge(self, i, step, j):
+        s = self.stepnum.get(step)
+        if s == None:
+            s = len(self.steps)
+            self.stepnum[step] = s
+            self.steps.append(step)
+        self.esrc.append(i)
+        self.estep.append(s)
+        self.edst.append(j)
+
+    def run(self, verbose=False):
+        """
+        Explore breadth first; return number of configurations.  Can be
+        called again after maxconf is raised.
+        """
+        self.t0 = time.time()
+        if not self.configs: self.add(self.initial())
+        configs = self.configs
+        index = self.index
+        add_edge = self.add_edge
+        while self.done < len(configs):
+            if self.maxconf and len(configs) >= self.maxconf: break
+            i = self.done
+            for step, key in self.successors(configs[i]):
+                j = index.get(key)
+                if j == None:
+                    j = len(configs)
+                    index[key] = j
+                    configs.append(key)
+                add_edge(i, step, j)
+            self.done = i + 1
+            if verbose and self.done % 100000 == 0: self.report()
+        if verbose: self.report()
+        self.elapsed = self.elapsed + time.time() - self.t0
+        self.t0 = None
+        return len(configs)
+
+    def report(self):
+        dt = self.elapsed
+        if self.t0: dt = dt + time.time() - self.t0
+        dt = max(dt, 1e-6)
+        print "explore %s: %d configurations (%d expanded), %d edges, " \
+            "%.0f/s" % (self.mach.name, len(self.configs), self.done,
+                        len(self.esrc), self.done/dt)
+
+    def edges(self):
+        trans = self.mach.trans
+        for e in range(len(self.esrc)):
+            step = tuple([trans[t] for t in self.steps[self.estep[e]]])
+            yield self.esrc[e], step, self.edst[e]
+
+class DiskExplorer(Explorer):
+    """
+    Usage:
+      dx = DiskExplorer(mach, path, ramsize=64<<20)
+      dx.run()                          # => number of configurations
+      dx.close()
+    Like Explorer.run but the visited set is a VisitedTable in files
+    path and path.q, past ramsize bytes paged to disk; configurations
+    and edges counted, not kept.  A run stopped (maxconf, close, or
+    killed) goes on from its last checkpoint with resume=True.
+    """
+
+    def __init__(self, mach, path, ramsize=64<<20, resume=False,
+                 maxconf=None, every=10000):
+        Explorer.__init__(self, mach, maxconf)
+        self.every = every              # checkpoint after this many
+        self.visited = VisitedTable(path, mach.nslot * self.width,
+                                    ramsize, resume, mach.name)
+        self.done = self.visited.done
+        self.nedge = self.visited.nedge
+        self.done0 = self.done          # expanded before this run
+
+    def run(self, verbose=False):
+        self.t0 = time.time()
+        vt = self.visited
+        if vt.count == 0: vt.add(self.initial())
+        add = vt.add
+        every = self.every
+        while self.done < vt.count:
+            if self.maxconf and vt.count >= self.maxconf: break
+            succ = self.successors(vt.key(self.done))
+            for step, key in succ:
+                add(key)
+            self.nedge = self.nedge + len(succ)
+            self.done = self.done + 1
+            if self.done % every == 0:
+                vt.checkpoint(self.done, self.nedge)
+                if verbose and self.done % (10*every) == 0: self.report()
+        vt.checkpoint(self.done, self.nedge)
+        if verbose: self.report()
+        self.elapsed = self.elapsed + time.time() - self.t0
+        self.t0 = None
+        return vt.count
+
+    def close(self):
+        self.visited.close(self.done, self.nedge)
+
+    def report(self):
+        dt = self.elapsed
+        if self.t0: dt = dt + time.time() - self.t0
+        dt = max(dt, 1e-6)
+        vt = self.visited
+        print "explore %s: %d configurations (%d expanded), %d edges, " \
+            "%.0f/s, table %s" % (self.mach.name, vt.count, self.done,
+                                  self.nedge, (self.done-self.done0)/dt,
+                                  vt.ondisk and 'on disk' or 'in memory')
+
+# Parallel exploration: njob worker processes, forked with the chart,
+# each owning the configurations k with hash(k) % njob == its number (a
+# shard of the visited set).  The search goes level by level.  The
+# parent sends each worker the batch of configurations found for it in
+# the last level, packed end to end in one string; the worker drops
+# those it has seen, expands the rest and returns their successors as
+# one packed batch per owner, which the parent passes on for the next
+# level.  Edges are counted, not kept.
+
+def shard_main(conn, mach, num, njob):
+    "Worker loop for ParallelExplorer; num is the shard owned."
+    ex = Explorer(mach)
+    visited = set()
+    kw = mach.nslot * ex.width          # bytes per configuration
+    while True:
+        batch = conn.recv()
+        if batch == None: break
+        nnew = 0
+        nedge = 0
+        outs = [set() for i in range(njob)]
+        for b in range(0, len(batch), kw):
+            key = batch[b:b+kw]
+            if key in visited: continue
+            visited.add(key)
+            nnew = nnew + 1
+            succ = ex.successors(key)
+            nedge = nedge + len(succ)
+            for step, key1 in succ:
+                outs[hash(key1) % njob].add(key1)
+        conn.send((nnew, nedge, [''.join(o) for o in outs]))
+    conn.send(len(visited))
+    conn.close()
+
+class ParallelExplorer:
+    """
+    Usage:
+      px = ParallelExplorer(mach, njob)
+      px.run()                          # => number of configurations
+    Like Explorer.run but in njob processes; configurations and edges
+    are counted, not kept.
+    """
+
+    def __init__(self, mach, njob):
+        self.mach = mach
+        self.njob = njob
+        self.nconf = 0
+        self.nedge = 0
+        self.nlevel = 0
+        self.elapsed = 0.0
+
+    def run(self, verbose=False):
+        njob = self.njob
+        t0 = time.time()
+        conns = []
+        procs = []
+        for num in range(njob):
+            c0, c1 = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=shard_main,
+                                        args=(c1, self.mach, num, njob))
+            p.start()
+            c1.close()
+            conns.append(c0)
+            procs.append(p)
+        ok = False
+        try:
+            init = Explorer(self.mach).initial()
+            pending = [[] for i in range(njob)]
+            pending[hash(init) % njob].append(init)
+            while [b for b in pending if b]:
+                for num in range(njob):
+                    conns[num].send(''.join(pending[num]))
+                pending = [[] for i in range(njob)]
+                for num in range(njob):
+                    nnew, nedge, outs = conns[num].recv()
+                    self.nconf = self.nconf + nnew
+                    self.nedge = self.nedge + nedge
+                    for o in range(njob):
+                        if outs[o]: pending[o].append(outs[o])
+                self.nlevel = self.nlevel + 1
+            nvis = 0
+            for conn in conns:
+                conn.send(None)
+                nvis = nvis + conn.recv()
+            ok = True
+        finally:
+            # on error the workers may be blocked on recv: stop them
+            if not ok:
+                for p in procs: p.terminate()
+            for p in procs: p.join()
+        if nvis != self.nconf:
+            raise Exception, "explore: shards hold %d configurations, " \
+                "counted %d" % (nvis, self.nconf)
+        self.elapsed = time.time() - t0
+        if verbose: self.report()
+        return self.nconf
+
+    def report(self):
+        print "explore %s: %d configurations, %d edges, %d levels, " \
+            "%d jobs, %.0f/s" % (self.mach.name, self.nconf, self.nedge,
+                                 self.nlevel, self.njob,
+                                 self.nconf/max(self.elapsed, 1e-6))
+
+# --- last line of explore.py ---
@@ -0,0 +1,268 @@
+# flatten.py - flatten ssk1 statecharts to minimal flat machines
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# The flat machine has the reachable configurations of the chart (see
+# explore.py) as states.  Its inputs are (label, guards) and its outputs
+# action sequences: for each transition of a step, the exit actions of
+# the states left (innermost first), the transition's actions, then the
+# entry actions of the states entered (outermost first).
+# It is for analysis (mdbench -y, the mdcnvt -F listing); no backend
+# generates code from it.
+#
+# minimize() merges equivalent states: Hopcroft's partition refinement,
+# over symbols (label, guards, actions), splitting by the smaller half.
+# The first partition puts states together that have the same symbols;
+# a missing move is then a difference, so no sink state is needed.  If a
+# state has two moves on one symbol (transitions that only a guard not
+# seen here could tell apart) Hopcroft does not apply and the blocks are
+# refined by signature (symbol, block of target) until stable.
+
+from ssk1 import chart_index, scope_index
+from explore import Explorer
+
+class FlatMachine:
+    """
+    Usage:
+      fm = flatten(mach)
+      fm.nstate                         # states 0 .. nstate-1, 0 initial
+      fm.moves[i]                       # list of (symbol, j)
+      fm.symbols[k]                     # (label, guards, actions)
+      fm2 = minimize(fm)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.nstate = 0
+        self.moves = []                 # state => [(symbol, target)]
+        self.symbols = []               # (label, guards, actions)
+        self.symnum = {}
+        self.names = []                 # state => name, for printing
+
+    def add_state(self, name=None):
+        self.moves.append([])
+        self.names.append(name)
+        self.nstate = self.nstate + 1
+        return self.nstate - 1
+
+    def add_move(self, i, symbol, j):
+        k = self.symnum.get(symbol)
+        if k == None:
+            k = len(self.symbols)
+            self.symnum[symbol] = k
+            self.symbols.append(symbol)
+        self.moves[i].append((k, j))
+
+    def nmove(self):
+        n = 0
+        for ms in self.moves: n = n + len(ms)
+        return n
+
+    def write(self, f1):
+        "Write as text, one line per move."
+        f1.write("flat %s: %d states, %d moves\n" % \
+                 (self.name, self.nstate, self.nmove()))
+        for i in range(self.nstate):
+            for k, j in self.moves[i]:
+                label, guards, actions = self.symbols[k]
+                f1.write("  %s --%s" % (self.names[i], label))
+                if guards: f1.write(" [%s]" % " && ".join(guards))
+                if actions: f1.write(" / %s" % "; ".join(actions))
+                f1.write("--> %s\n" % (self.names[j],))
+
+def active(ci, enc):
+    "Return active state numbers of configuration enc, leaves first."
+    seen = {}
+    res = []
+    for id in enc:
+        if not id: continue
+        n = ci.byid[id]
+        while n >= 0 and not seen.has_key(n):
+            seen[n] = 1
+            res.append(n)
+            n = ci.parent[n]
+    return res
+
+def in_scope(ci, n, r):
+    "Is state number n in region number r (r < 0: anywhere)?"
+    if r < 0: return True
+    while n >= 0:
+        if ci.preg[n] == r: return True
+        n = ci.parent[n]
+    return False
+
+def step_actions(mach, step, enc0, enc1):
+    """
+    Return tuple of actions for step (transitions) from configuration
+    enc0 to enc1.
+    """
+    ci = chart_index(mach)
+    si = scope_index(mach)
+    act0 = active(ci, enc0)
+    act1 = active(ci, enc1)
+    res = []
+    for t in step:
+        r = si.region_num(ci.num[t.source], ci.num[t.target])
+        # exits innermost first, entries outermost first
+        xs = [n for n in act0 if in_scope(ci, n, r)]
+        xs.sort(key=lambda n: -ci.level[n])
+        ns = [n for n in act1 if in_scope(ci, n, r)]
+        ns.sort(key=lambda n: (ci.level[n], n))
+        for n in xs: res.extend(ci.state[n].a_ex)
+        res.extend(t.actions)
+        for n in ns: res.extend(ci.state[n].a_en)
+    return tuple(res)
+
+def config_name(mach, enc):
+    return '(' + ','.join([mach.idmap[id].name for id in enc if id]) + ')'
+
+def flatten(mach, maxconf=None):
+    """
+    Return FlatMachine for indexed chart mach: its reachable
+    configurations with the steps between them.
+    """
+    ex = Explorer(mach, maxconf)
+    ex.run()
+    if ex.done < len(ex.configs):
+        raise Exception, "flatten: more than %d configurations" % maxconf
+    fm = FlatMachine(mach.name)
+    encs = [ex.unpack(key) for key in ex.configs]
+    for enc in encs:
+        fm.add_state(config_name(mach, enc))
+    for i, step, j in ex.edges():
+        guards = tuple([t.guard for t in step if t.guard])
+        actions = step_actions(mach, step, encs[i], encs[j])
+        fm.add_move(i, (step[0].label, guards, actions), j)
+    return fm
+
+def deterministic(fm):
+    for ms in fm.moves:
+        syms = {}
+        for k, j in ms:
+            if syms.get(k, j) != j: return False
+            syms[k] = j
+    return True
+
+def hopcroft(fm):
+    "Return block number for each state (deterministic fm)."
+    n = fm.nstate
+    # first partition: states with the same symbols
+    block = n*[0]
+    bykey = {}
+    members = []
+    for i in range(n):
+        key = tuple(sorted(set([k for k, j in fm.moves[i]])))
+        b = bykey.get(key)
+        if b == None:
+            b = len(members)
+            bykey[key] = b
+            members.append([])
+        block[i] = b
+        members[b].append(i)
+    # inverse moves: symbol => target => sources
+    inv = {}
+    for i in range(n):
+        for k, j in fm.moves[i]:
+            inv.setdefault(k, {}).setdefault(j, []).append(i)
+    work = [(b, k) for b in range(len(members)) for k in inv.keys()]
+    inwork = set(work)
+    while work:
+        b, k = work.pop()
+        inwork.discard((b, k))
+        # states moving on k into block b
+        pre = set()
+        tk = inv.get(k, {})
+        for j in members[b]:
+            pre.update(tk.get(j, ()))
+        if not pre: continue
+        touched = {}
+        for i in pre:
+            touched.setdefault(block[i], []).append(i)
+        for c, ins in touched.items():
+            if len(ins) == len(members[c]): continue
+            inset = set(ins)
+            outs = [i for i in members[c] if i not in inset]
+            d = len(members)
+            members[c] = ins
+            members.append(outs)
+            for i in outs: block[i] = d
+            for k1 in inv.keys():
+                if (c, k1) in inwork:
+                    work.append((d, k1)); inwork.add((d, k1))
+                else:
+                    # the smaller half is enough
+                    if len(ins) <= len(outs): e = c
+                    else: e = d
+                    work.append((e, k1)); inwork.add((e, k1))
+    return block
+
+def refine(fm):
+    "Return block number for each state, by signatures until stable."
+    n = fm.nstate
+    block = n*[0]
+    nblock = 1
+    while True:
+        sigs = {}
+        new = n*[0]
+        for i in range(n):
+            sig = (block[i], tuple(sorted(set(
+                [(k, block[j]) for k, j in fm.moves[i]]))))
+            b = sigs.get(sig)
+            if b == None:
+                b = len(sigs)
+                sigs[sig] = b
+            new[i] = b
+        block = new
+        if len(sigs) == nblock: return block
+        nblock = len(sigs)
+
+def minimize(fm):
+    """
+    Return FlatMachine with the states of fm that are equivalent merged,
+    the initial state kept as 0.
+    """
+    if deterministic(fm): block = hopcroft(fm)
+    else: block = refine(fm)
+    # number blocks in order of first state, so the initial one is 0
+    num = {}
+    for i in range(fm.nstate):
+        if not num.has_key(block[i]): num[block[i]] = len(num)
+    res = FlatMachine(fm.name)
+    first = {}
+    for i in range(fm.nstate):
+        b = num[block[i]]
+        if not first.has_key(b):
+            first[b] = i
+            res.add_state(fm.names[i])
+    for b in range(res.nstate):
+        i = first[b]
+        seen = {}
+        for k, j in fm.moves[i]:
+            m = (k, num[block[j]])
+            if seen.has_key(m): continue
+            seen[m] = 1
+            res.add_move(b, fm.symbols[k], m[1])
+    return res
+
+def flatten_report(mach, maxconf=None):
+    "Flatten and minimize mach; print and return the counts."
+    fm = flatten(mach, maxconf)
+    fm2 = minimize(fm)
+    print "flatten %s: %d states, %d moves; minimized: %d states, %d moves" % \
+        (mach.name, fm.nstate, fm.nmove(), fm2.nstate, fm2.nmove())
+    return fm, fm2
+
+# --- last line of flatten.py ---
@@ -28,25 +28,46 @@
 
 import re
 
-def deepest_common_region(st1, st2):
+from ssk1 import chart_index, trans_index, scope_index
+
+def deepest_common_region(st1, st2, mach=None):
     """
     Find parent region common to st1 and st2 that is deepest in the
     hierarchy.
     This is also called the least common ancestor (LCA) in UML2.  However,
     in UML2 the LCA can be a state if the transition crosses regions of an
     orthogonal state.  We don't allow transitions to cross regions, do we?
+    With mach, from its ScopeIndex; else by walking up the parents.
     """
+    if mach: return scope_index(mach).region(st1, st2)
     if st1.level > st2.level:
         while st1.level > st2.level:
             st1 = st1.parent.parent
     elif st2.level > st1.level:
         while st2.level > st1.level:
             st2 = st2.parent.parent
-    reg1 = st1.parent; reg2 = st2.parent
-    while reg1 != reg2:
-        reg1 = reg2.parent.parent
-        reg2 = reg2.parent.parent
-    return reg1
+    while st1 != st2 and st1.parent != st2.parent:
+        st1 = st1.parent.parent
+        st2 = st2.parent.parent
+    return st1.parent
+
+def trans_scope(src, dst, mach=None):
+    """
+    Return (region, exits, entries) for transition from src to dst: the
+    deepest common region, the states exited (src first) and the states
+    entered (dst last).  With mach, kept in its ScopeIndex.
+    """
+    if mach: return scope_index(mach).trans(src, dst)
+    r = deepest_common_region(src, dst)
+    exits = [src]
+    while src.parent != r:
+        src = src.parent.parent
+        exits.append(src)
+    entries = [dst]
+    while dst.parent != r:
+        dst = dst.parent.parent
+        entries.insert(0, dst)
+    return r, exits, entries
 
 def writedef(f1, name, val):
     tabs = '\t\t\t\t\t\t\t'
@@ -91,39 +112,31 @@ def name_genC(n0):
     n2 = re.sub('-', '_', n1)
     return n2
 
-def gen_trans_actions(src, tract, dst):
+def gen_trans_actions(src, tract, dst, mach=None):
     # generate list of all actions to make state transition
     # src: source state
     # tract: list of actions for the transaction
     # dst: destination state
-    r = deepest_common_region(src, dst)
-    up = []
-    while src.parent != r:
-        up.append(src.a_ex)
-        src = src.parent.parent
-    up.append(src.a_ex)
-    dn = []
-    while dst.parent != r:
-        dn.insert(0, dst.a_en)
-        dst = dst.parent.parent
-    dn.insert(0, dst.a_en)
+    # mach: statechart, to use its ScopeIndex
+    r, exits, entries = trans_scope(src, dst, mach)
+    up = [s.a_ex for s in exits]
+    dn = [s.a_en for s in entries]
     res = []; res.extend(up); res.extend(tract); res.extend(dn)
     return res
 
 # === state encoding =======
 
-def follow_trans(src, dst):
+def follow_trans(src, dst, mach=None):
     xl = []; nl = []                    # eXit list, eNter list
-    r = deepest_common_region(src, dst)
-    while src.parent != r:
+    r, exits, entries = trans_scope(src, dst, mach)
+    for s in exits[:-1]:
         # exit state
-        xl.append((src.a_ex, src.parent.parent))
-        src = src.parent.parent
-    while dst.parent != r:
-        nl.insert(0, (dst.a_en, dst))
-        dst = dst.parent.parent
+        xl.append((s.a_ex, s.parent.parent))
+    for s in entries[1:]:
+        nl.append((s.a_en, s))
+    return xl, nl
 
-def gen_encoding(src, dst):
+def gen_encoding(src, dst, mach=None):
     """
     This routine computes the change in state encoding.  The first element is
     the offset; remaining elements are the values to be added.
@@ -131,14 +144,11 @@ def gen_encoding(src, dst):
     I'm not sure this works with orthogonal regions.
     """
     # compute offset
-    r = deepest_common_region(src, dst)
+    r, exits, entries = trans_scope(src, dst, mach)
     code = [r.offset]                   # code change for dst state
     so = src.parent.offset              # src offset
     do = dst.parent.offset              # dst offset
-    while dst.parent != r:
-        code.insert(1, dst.index)
-        dst = dst.parent.parent
-    code.insert(1, dst.index)
+    code.extend([s.index for s in entries])
     #print "so,do=", so, do
     while do < so:
         do = do + 1
@@ -164,48 +174,29 @@ def gen_initial(ss):
     s_init(code, ss.root)
     return code
 
-def collect_otrans(state):
+def collect_otrans(state, mach):
     """
     Collect outgoing transitions from (leaf) state and all parents.
-    The problem is how to collect these.
-    This should return something like the following, where
+    This returns one list per source state, innermost first, as in
     res = [[['labA',guard,actions,dst], ['labA',guard,actions,dst]],
            [['labA',guard,actions,dst], [guard,...]],
           ]
+    (from the TransitionIndex, so in label order for each source).
     """
-    def cmp(a,b): 
-        if a.label == None: return -1
-        if a.label <= b.label: return 1
-        return -1
     res = []
-    while state.id != 0:
-        res1 = []
-        for t in state.otrans:
-            res1.append(t)
-        res1.sort(cmp)
-        #print res1
-        res.append(res1)
-        state = state.parent.parent
+    for t in trans_index(mach).ordered(state.id):
+        if res and res[-1][0].source is t.source:
+            res[-1].append(t)
+        else:
+            res.append([t])
     return res
 
 def collect_leaves(mach):
     """
     This routine collects all leaf (aka simple) states.
     """
-    def inR(region):
-        l = []
-        for s in region.state:
-            if len(s.region) == 0:
-                l.append(s)
-            else:
-                l.extend(inS(s))
-        return l
-    def inS(state):
-        l = []
-        for r in state.region:
-            l.extend(inR(r))
-        return l
-    return inS(mach.root)
+    ci = chart_index(mach)
+    return [ci.state[n] for n in ci.leaves()]
 
         
 # --- last line of impl.py ---
@@ -20,6 +20,7 @@
 
 from impl import *
 from ssk1 import *
+from explore import Explorer
 import re, string
 
 def stname(longname):
@@ -53,20 +54,22 @@ class C2Impl(Impl):
     def __init__(self, mach, config=default_config):
         Impl.__init__(self, config)
         self.mach = mach
+        self.nslot = mach.root.nslot
         self.initvals = [0]*mach.root.nslot
+        self.explorer = Explorer(mach)  # slot writes, see trans_body
 
     def speccode1s(self, f1, state=None):
         if not state: state = self.mach.root
-        for r in state.region:
-            self.speccode1r(f1, r)
+        ci = chart_index(self.mach)
+        for r in ci.subregions(ci.num[state]):
+            self.speccode1r(f1, ci.region[r])
 
     def speccode1r(self, f1, region):
+        # states of region only; speccode1s visits the regions below
         for s in region.state:
             # changed from s.offset to s.id
             #f1.write("#define %s\t\t%d\n" % (stname(s.name), s.id))
             writedef(f1, stname(s.name), s.id)
-        for s in region.state:
-            if len(s.region) > 0: self.speccode1s(f1, s)
 
     def dump_spec(self, f1, pmach=None):
         #
@@ -86,63 +89,106 @@ class C2Impl(Impl):
         f1.write("\n")
 
     def state_body(self, f1, state):
-        region = state.region
-        lev = state.level
-        nd = inspc(lev)
-        if len(region) > 0:
-            for region in state.region:
-                self.region_body(f1, region)
-        else:
-            if state.otrans:
-                f1.write(nd+"switch (evt) {\n")
-                for t in state.otrans:
-                    # ERROR!!!  There may also be transitions from all parent 
-                    # (composite) states !!!
-                    f1.write(nd+"case %s:\n" % (t.label))
-                    src = state
-                    dst = t.target
-                    #f1.write(nd+"  /* %d -> %d */\n" % (src.id, dst.id))
-                    f1.write(nd+"  /* %s -> %s */\n" % (src.name, dst.name))
-                    al = gen_trans_actions(src, t.actions, dst)
-                    for a in al:
-                        if a: f1.write(nd+"  %s;\n" % (a))
-                    code = gen_encoding(src, dst)
-                    ix = code.pop(0)
-                    for x in code:
-                        f1.write(nd+"  mst_next[%d] = %d;\n" % (ix, x))
-                        ix = ix + 1
-                    f1.write(nd+"  break;\n")
-                f1.write(nd+"}\n")
-                f1.write(nd+"/* selfloop internal transitions not done */")
-
-    def region_body(self, f1, region):
-        lev = region.parent.level
-        nd = inspc(lev)
-        #
-        offset = region.offset
-        f1.write(nd+"/* state %s, region %s */\n" % \
-                 (region.parent.name, region.name))
-        f1.write(nd+"switch (mst_curr[%d]) {\n" % (offset,))
-        for state in region.state:
-            f1.write(nd+"case %s:\n" % (stname(state.name)))
-            self.state_body(f1, state)
-            f1.write(nd+"  break;\n")
-        f1.write(nd+"}\n")
+        # The encoding is that of explore.py: slot o holds the id of the
+        # active leaf of the region at offset o, or 0.  So there is one
+        # switch per slot, on the leaves there.  Slots are looked at in
+        # order; w/ more than one, a leaf in a slot rewritten in this step,
+        # or whose transition would rewrite such a slot, is skipped (as in
+        # impl_ctab), which is what skip is for.
+        ci = chart_index(self.mach)
+        byslot = {}
+        for n in ci.leaves():
+            if ci.state[n] is state or self.below(ci.state[n], state):
+                o = ci.roffset[ci.preg[n]]
+                byslot.setdefault(o, []).append(ci.state[n])
+        if self.nslot > 1: f1.write("  int skip = 0;\n\n")
+        for o in sorted(byslot.keys()):
+            if o > 0: f1.write("  if (skip <= %d)\n" % (o,))
+            f1.write("  switch (mst_curr[%d]) {\n" % (o,))
+            for leaf in byslot[o]:
+                # ids, not ST_ names: copies of a submachine share names
+                f1.write("  case %d: /* %s */\n" % (leaf.id, leaf.fullname))
+                self.leaf_body(f1, leaf, o)
+                f1.write("    break;\n")
+            f1.write("  }\n")
+
+    def below(self, s, state):
+        while s.parent:
+            s = s.parent.parent
+            if s is state: return True
+        return False
+
+    def leaf_body(self, f1, state, slot=0):
+        nd = "    "
+        ti = trans_index(self.mach)
+        enabled = ti.enabled(state.id)
+        # one case per label, in order of first transition; the
+        # transitions of a label are those of the state and of the
+        # enclosing (composite) states, innermost first: see
+        # TransitionIndex.  Guards are tried in that order.  One w/ a
+        # scope above slot needs that scope not written yet.
+        labels = []
+        for t in ti.ordered(state.id):  # was .otrans
+            if t.label not in labels: labels.append(t.label)
+        if labels:
+            f1.write(nd+"switch (evt) {\n")
+            for label in labels:
+                f1.write(nd+"case %s:\n" % (label))
+                opened = False
+                for t in enabled[label]:
+                    beg, end, pat = self.explorer.enter(t)
+                    conds = []
+                    if beg < slot: conds.append("skip <= %d" % (beg,))
+                    if t.guard and conds: conds.append("(%s)" % (t.guard))
+                    elif t.guard: conds.append(t.guard)
+                    if conds:
+                        cond = " && ".join(conds)
+                        if opened: f1.write(nd+"  } else if (%s) {\n" % \
+                                            (cond))
+                        else: f1.write(nd+"  if (%s) {\n" % (cond))
+                        opened = True
+                        self.trans_body(f1, state, t, nd+"    ")
+                        continue
+                    if opened:
+                        f1.write(nd+"  } else {\n")
+                        self.trans_body(f1, state, t, nd+"    ")
+                    else:
+                        self.trans_body(f1, state, t, nd+"  ")
+                    break               # others can't be taken
+                if opened: f1.write(nd+"  }\n")
+                f1.write(nd+"  break;\n")
+            f1.write(nd+"}\n")
+            f1.write(nd+"/* selfloop internal transitions not done */\n")
+
+    def trans_body(self, f1, src, t, nd):
+        # actions and state change for leaf src taking t: the slots of
+        # t's scope region, as explore.Explorer.enter
+        dst = t.target
+        #f1.write(nd+"/* %d -> %d */\n" % (src.id, dst.id))
+        f1.write(nd+"/* %s -> %s */\n" % (src.name, dst.name))
+        al = gen_trans_actions(src, t.actions, dst, self.mach)
+        for a in al:
+            if a: f1.write(nd+"%s;\n" % (a))
+        ex = self.explorer
+        beg, end, pat = ex.enter(t)
+        vals = ex.unpack(pat)
+        for ix in range(beg, end):
+            f1.write(nd+"mst_next[%d] = %d;\n" % (ix, vals[ix - beg]))
+        if self.nslot > 1: f1.write(nd+"skip = %d;\n" % (end,))
 
     def state_init(self, f1, state):
         # fill in body of init routine
-        for region in state.region:
-            self.region_init(f1, region)
+        ci = chart_index(self.mach)
+        for r in ci.subregions(ci.num[state]):
+            self.region_init(f1, ci.region[r])
 
     def region_init(self, f1, region):
-        # fill in body of init routine
+        # fill in body of init routine, for region only (see state_init)
         if False:
             f1.write("  mst_next[%d] = %d;\n" % \
                      (region.offset, region.initial))
         if True:
             self.initvals[region.offset] = region.initial
-        for state in region.state:
-            self.state_init(f1, state)
 
     def dump_body(self, f1, mach=None):
         # Generate the implementation part (.c file) for the statechart.
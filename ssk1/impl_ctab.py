@@ -0,0 +1,262 @@
+# impl_ctab.py - table-driven C code backend
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# In place of the switches of impl_c2, the transitions go into static
+# const tables and one generic <mach>_exec walks them:
+#  * <mach>_tr[], entries (guard id, action id, delta id): those enabled
+#    in leaf id (TransitionIndex.ordered) for event e are, w/ k = id*NEV
+#    + e, <mach>_tr_ix[k] .. <mach>_tr_ix[k+1]-1, innermost source first;
+#    exec takes the first entry whose guard holds.  Events are small
+#    dense numbers, so this is one lookup, no search.
+#  * <mach>_delta[], (offset, length, index into <mach>_val[]): the
+#    slots a transition rewrites, as explore.Explorer.enter, i.e. the
+#    slots of its scope region.
+#  * guards and action sequences, numbered from 1 (0: none), are cases
+#    of <mach>_guard() and <mach>_act(); equal ones share a number.
+# Events are numbered: EV_<label> from 1 in label order, 0 for
+# completion transitions.  The state encoding is that of explore.py: a
+# slot holds the id of the active leaf of the region at that offset, or
+# 0; slots are <mach>_mst_t, unsigned char or, for ids over 255, short.
+# exec looks at the slots in order; a leaf in a slot rewritten in this
+# step, or whose transition would rewrite such a slot, is skipped.
+
+from impl import *
+from impl_c2 import C2Impl, evname, default_config
+from ssk1 import chart_index, trans_index, scope_index
+
+def ctype(maxval):
+    "Smallest unsigned C type for 0 .. maxval."
+    if maxval < 1<<8: return "unsigned char"
+    if maxval < 1<<16: return "unsigned short"
+    return "unsigned int"
+
+def flat_actions(al):
+    # a_en, a_ex are lists of actions, so gen_trans_actions gives both
+    res = []
+    for a in al:
+        if isinstance(a, (list, tuple)): res.extend([x for x in a if x])
+        elif a: res.append(a)
+    return tuple(res)
+
+class Numbering:
+    "Numbers for distinct keys, from first (0 or 1)."
+
+    def __init__(self, first=1):
+        self.num = {}
+        self.keys = []
+        self.first = first
+
+    def get(self, key):
+        n = self.num.get(key)
+        if n == None:
+            n = len(self.keys) + self.first
+            self.num[key] = n
+            self.keys.append(key)
+        return n
+
+class CTabImpl(C2Impl):
+
+    def __init__(self, mach, config=default_config):
+        C2Impl.__init__(self, mach, config)
+        self.events = {}                # label => event number
+        self.guards = Numbering()       # guard text
+        self.acts = Numbering()         # tuple of actions
+        self.deltas = Numbering(0)      # (offset, slot values)
+        self.tr = []                    # (guard, act, delta)
+        self.tr_ix = []                 # id*nev + event => first entry
+        self.nev = 1                    # events, w/ 0
+
+    def event_numbers(self):
+        labels = [l for l in trans_index(self.mach).labels() if l]
+        labels.sort()
+        self.events = {None: 0, '': 0}
+        for i in range(len(labels)):
+            self.events[labels[i]] = i + 1
+        self.nev = len(labels) + 1
+        return labels
+
+    def leaf_actions(self, leaf, t):
+        "Actions for leaf taking t: exits (leaf up), t's, entries."
+        r, exits, entries = scope_index(self.mach).trans(t.source, t.target)
+        ups = []
+        s = leaf
+        while s is not t.source:
+            ups.append(s)
+            s = s.parent.parent
+        ups.extend(exits)
+        al = [s.a_ex for s in ups]
+        al.extend(t.actions)
+        al.extend([s.a_en for s in entries])
+        return flat_actions(al)
+
+    def make_tables(self):
+        mach = self.mach
+        ci = chart_index(mach)
+        ti = trans_index(mach)
+        ex = self.explorer
+        self.event_numbers()
+        enters = {}                     # Transition => delta number
+        byid = {}                       # leaf id => entries
+        maxleaf = 0
+        for n in ci.leaves():
+            id = ci.id[n]
+            maxleaf = max(maxleaf, id)
+            ents = []
+            ts = ti.ordered(id)
+            for pos in range(len(ts)):
+                t = ts[pos]
+                d = enters.get(t)
+                if d == None:
+                    beg, end, pat = ex.enter(t)
+                    d = self.deltas.get((beg, ex.unpack(pat)))
+                    enters[t] = d
+                if t.guard: g = self.guards.get(t.guard)
+                else: g = 0
+                acts = self.leaf_actions(ci.state[n], t)
+                if acts: a = self.acts.get(acts)
+                else: a = 0
+                ents.append((self.events[t.label], pos, g, a, d))
+            ents.sort()
+            byid[id] = ents
+        # rows for ids 0 .. maxleaf (composites are never in a slot)
+        self.tr = []
+        self.tr_ix = []
+        for id in range(maxleaf + 1):
+            ents = byid.get(id, ())
+            i = 0
+            for e in range(self.nev):
+                self.tr_ix.append(len(self.tr))
+                while i < len(ents) and ents[i][0] == e:
+                    self.tr.append(ents[i][2:])
+                    i = i + 1
+        self.tr_ix.append(len(self.tr))
+        self.initvals = list(ex.unpack(ex.initial()))
+
+    def write_array(self, f1, ctyp, name, vals, per=12):
+        f1.write("static const %s %s[%d] = {\n" % (ctyp, name, len(vals)))
+        for i in range(0, len(vals), per):
+            f1.write("  %s,\n" % (", ".join(map(str, vals[i:i+per]))))
+        f1.write("};\n\n")
+
+    def write_tables(self, f1, name):
+        # deltas: offset, length, values pooled in <name>_val
+        vals = []
+        drows = []
+        for off, enc in self.deltas.keys:
+            drows.append((off, len(enc), len(vals)))
+            vals.extend(enc)
+        if not vals: vals = [0]
+        f1.write("typedef struct {\n")
+        f1.write("  %s guard, act, delta;\n" % \
+                 ctype(max([0] + [max(e) for e in self.tr])))
+        f1.write("} %s_tr_t;\n\n" % (name))
+        f1.write("typedef struct {\n")
+        f1.write("  %s off, len;\n" % \
+                 ctype(max([1] + [max(d[0], d[1]) for d in drows])))
+        f1.write("  %s val;\n" % (ctype(len(vals))))
+        f1.write("} %s_delta_t;\n\n" % (name))
+        self.write_array(f1, ctype(self.mach.maxid), name + "_val", vals)
+        self.write_array(f1, ctype(len(self.tr)), name + "_tr_ix",
+                         self.tr_ix, self.nev)
+        tr = self.tr or [(0, 0, 0)]
+        f1.write("static const %s_tr_t %s_tr[%d] = {\n" % \
+                 (name, name, len(tr)))
+        for g, a, d in tr:
+            f1.write("  { %d, %d, %d },\n" % (g, a, d))
+        f1.write("};\n\n")
+        f1.write("static const %s_delta_t %s_delta[%d] = {\n" % \
+                 (name, name, len(drows) or 1))
+        for off, n, v in drows or [(0, 0, 0)]:
+            f1.write("  { %d, %d, %d },\n" % (off, n, v))
+        f1.write("};\n\n")
+
+    def write_cases(self, f1, name):
+        if self.guards.keys:
+            f1.write("static int\n%s_guard(int g)\n{\n" % (name))
+            f1.write("  switch (g) {\n")
+            for g in range(len(self.guards.keys)):
+                f1.write("  case %d: return (%s);\n" % \
+                         (g + 1, self.guards.keys[g]))
+            f1.write("  }\n  return 1;\n}\n\n")
+        if self.acts.keys:
+            f1.write("static void\n%s_act(int a)\n{\n" % (name))
+            f1.write("  switch (a) {\n")
+            for a in range(len(self.acts.keys)):
+                f1.write("  case %d:\n" % (a + 1))
+                for x in self.acts.keys[a]:
+                    f1.write("    %s;\n" % (x.rstrip().rstrip(";")))
+                f1.write("    break;\n")
+            f1.write("  }\n}\n\n")
+
+    def write_exec(self, f1, name):
+        et = self.config['event_type']
+        f1.write("void\n%s_exec(const %s_mst_t *mst_curr, %s evt, "
+                 "%s_mst_t *mst_next)\n{\n" % (name, name, et, name))
+        f1.write("  int o, id, e, hi, k, skip = 0;\n")
+        f1.write("  const %s_tr_t *t;\n" % (name))
+        f1.write("  const %s_delta_t *d;\n\n" % (name))
+        f1.write("  if ((unsigned) evt >= NEV) return;\n")
+        f1.write("  for (o = 0; o < MACH_SIZE; o++) {\n")
+        f1.write("    id = mst_curr[o];\n")
+        f1.write("    if (id == 0 || o < skip) continue;\n")
+        f1.write("    /* entries of leaf id w/ event evt */\n")
+        f1.write("    k = id*NEV + evt;\n")
+        f1.write("    hi = %s_tr_ix[k+1];\n" % (name))
+        f1.write("    for (e = %s_tr_ix[k]; e < hi; e++) {\n" % (name))
+        f1.write("      t = &%s_tr[e];\n" % (name))
+        f1.write("      d = &%s_delta[t->delta];\n" % (name))
+        f1.write("      if (d->off < skip) continue;\n")
+        if self.guards.keys:
+            f1.write("      if (t->guard && !%s_guard(t->guard)) continue;\n" \
+                     % (name))
+        if self.acts.keys:
+            f1.write("      if (t->act) %s_act(t->act);\n" % (name))
+        f1.write("      for (k = 0; k < d->len; k++)\n")
+        f1.write("        mst_next[d->off + k] = %s_val[d->val + k];\n" % \
+                 (name))
+        f1.write("      skip = d->off + d->len;\n")
+        f1.write("      break;\n")
+        f1.write("    }\n")
+        f1.write("  }\n")
+        f1.write("}\n\n")
+
+    def dump_body(self, f1, mach=None):
+        # Generate the implementation part (.c file) for the statechart.
+        if not mach: mach = self.mach
+        name = cname(mach.name)
+        labels = self.event_numbers()
+        self.make_tables()
+        #
+        self.speccode1s(f1)
+        for label in labels:
+            writedef(f1, evname(label), self.events[label])
+        writedef(f1, "MACH_SIZE", mach.root.nslot)
+        writedef(f1, "NEV", self.nev)
+        f1.write("\n")
+        #
+        f1.write("typedef %s %s_mst_t;\n\n" % (ctype(mach.maxid), name))
+        f1.write("static const %s_mst_t mst_default[] = { " % (name) + \
+                 ", ".join(map(str, self.initvals)) + " };\n\n")
+        f1.write("void\n%s_init(%s_mst_t *mst)\n{\n" % (name, name))
+        f1.write("  memcpy(mst, mst_default, sizeof(mst_default));\n")
+        f1.write("}\n\n")
+        #
+        self.write_tables(f1, name)
+        self.write_cases(f1, name)
+        self.write_exec(f1, name)
+
+# --- last line of impl_ctab.py ---
@@ -104,7 +104,7 @@ class PmlImpl(Impl):
         f1.write("   :: st == " + state.name + " ->\n")
         nd = "      "
         # NEEDS WORK: labeled vs. non-labeled AND leaf vs parents
-        ot = collect_otrans(state) # does not get loop-transitions yet
+        ot = collect_otrans(state, self.mach) # no loop-transitions yet
         f1.write(nd+"if\n")
         for tl in ot:
             lab = None
@@ -0,0 +1,197 @@
+# mdcache.py - on-disk cache of parsed MagicDraw models
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# The uml2 tree (model, extns) read_model produces after patchup is saved
+# under a key made from the SHA-1 of the model XML (the bytes of the .model
+# member for .mdzip files), cache_format and the source of the modules that
+# build the tree (mdreader, uml2, mdext, mdcache), so a hit is only possible
+# for the same model read by the same code.  Cache files are <key>.mdc in
+# the cache directory; the total size is kept under maxsize by removing
+# least recently used files.
+#
+# The tree is a graph with long reference chains (transitions point at
+# states, states at transitions, ...), too deep for pickle's recursion.
+# So the instances are flattened: the file holds the list of classes,
+# then the list of instance dicts with every instance reference replaced
+# by a persistent id (its index in the list), then (model, extns).
+
+import gc
+import os
+import types
+import hashlib
+import cPickle
+
+import mdreader, uml2, mdext
+from mdreader import open_model, read_model
+
+# Bump this when the file layout changes; changes to the reader or uml2
+# are caught by reader_digest().
+cache_format = 4
+
+_reader_digest = None
+
+def reader_digest():
+    "SHA-1 of the source of the modules the cached tree depends on."
+    global _reader_digest
+    if _reader_digest == None:
+        h = hashlib.sha1()
+        for path in (mdreader.__file__, uml2.__file__, mdext.__file__,
+                     __file__):
+            if path[-4:] in (".pyc", ".pyo") and os.path.exists(path[:-1]):
+                path = path[:-1]
+            f1 = open(path, "rb")
+            try:
+                h.update(f1.read())
+            finally:
+                f1.close()
+        _reader_digest = h.hexdigest()
+    return _reader_digest
+
+class ModelCache:
+    """
+    Cache of parsed models in directory cachedir.  Use read_model() in
+    place of mdreader.read_model(); it returns (model, extns).
+    """
+
+    def __init__(self, cachedir, maxsize=256<<20):
+        self.cachedir = cachedir
+        self.maxsize = maxsize          # bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def key(self, filename, machs=None):
+        "Key for filename: hash of the model XML, reader, format, selection."
+        h = hashlib.sha1()
+        h.update("ssk-cache/%d/%s\n" % (cache_format, reader_digest()))
+        if machs != None:
+            h.update("machs=%s\n" % ",".join(sorted(machs)))
+        f1 = open_model(filename)
+        try:
+            while True:
+                buf = f1.read(1<<16)
+                if not buf: break
+                h.update(buf)
+        finally:
+            f1.close()
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key + ".mdc")
+
+    def read_model(self, filename, sax=False, verbose=False, machs=None):
+        key = self.key(filename, machs)
+        res = self.load(key)
+        if res:
+            self.hits = self.hits + 1
+            return res
+        self.misses = self.misses + 1
+        mdh = read_model(filename, sax, verbose, machs)
+        self.save(key, mdh.model, mdh.extns)
+        return mdh.model, mdh.extns
+
+    def load(self, key):
+        "Return (model, extns) for key or None if not cached."
+        path = self.path(key)
+        try:
+            f1 = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                return load_tree(f1)
+            except Exception:
+                # Stale or truncated: drop it and parse again.
+                os.remove(path)
+                return None
+        finally:
+            f1.close()
+            if os.path.exists(path):
+                os.utime(path, None)    # mark as recently used
+
+    def save(self, key, model, extns):
+        path = self.path(key)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        f1 = open(tmp, 'wb')
+        try:
+            dump_tree(f1, model, extns)
+        finally:
+            f1.close()
+        os.rename(tmp, path)            # atomic w.r.t. other readers
+        self.evict()
+
+    def evict(self):
+        "Remove least recently used files until under maxsize."
+        files = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if not name.endswith(".mdc"): continue
+            path = os.path.join(self.cachedir, name)
+            st = os.stat(path)
+            files.append((st.st_mtime, st.st_size, path))
+            total = total + st.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.maxsize: break
+            os.remove(path)
+            total = total - size
+
+def instances(roots):
+    "Return list of instances reachable from roots and id->index dict."
+    objs = []
+    index = {}
+    stack = list(roots)
+    while stack:
+        v = stack.pop()
+        t = type(v)
+        if t == types.InstanceType:
+            if index.has_key(id(v)): continue
+            index[id(v)] = len(objs)
+            objs.append(v)
+            stack.extend(v.__dict__.itervalues())
+        elif isinstance(v, (list, tuple, set, frozenset)):
+            stack.extend(v)             # incl uml2.TransitionList
+        elif isinstance(v, dict):
+            stack.extend(v.itervalues())
+    return objs, index
+
+def dump_tree(f1, model, extns):
+    objs, index = instances([model] + extns)
+    p = cPickle.Pickler(f1, 2)
+    p.dump([o.__class__ for o in objs])
+    p.persistent_id = lambda v: index.get(id(v))
+    p.dump(([o.__dict__ for o in objs], model, extns))
+
+def load_tree(f1):
+    # The collector would scan the growing heap over and over while the
+    # instances are created (it's most of the load time); nothing here
+    # is garbage so turn it off.
+    gcon = gc.isenabled()
+    gc.disable()
+    try:
+        u = cPickle.Unpickler(f1)
+        objs = [types.InstanceType(c) for c in u.load()]
+        u.persistent_load = objs.__getitem__
+        dicts, model, extns = u.load()
+        for i in range(len(objs)):
+            objs[i].__dict__ = dicts[i]
+    finally:
+        if gcon: gc.enable()
+    return model, extns
+
+# --- last line of mdcache.py ---
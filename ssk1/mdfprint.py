@@ -0,0 +1,205 @@
+# mdfprint.py - content fingerprints of state machines in a uml2 model
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# The fingerprint of a StateMachine is a Merkle hash over its subtree:
+# each region, vertex and transition gets a SHA-1 digest of its own
+# values and the digests of its parts, and the machine's digest covers
+# its regions and connection points.  Covered are names, pseudostate
+# kinds, entry/exit/do behaviors, invariants, transitions (ends, kind,
+# triggers with their signals or events, guards and effects) and, for
+# submachine states, the fingerprint of the submachine.  xmi:ids and
+# diagrams are not covered: they don't change what is generated.
+#
+# Transition ends are named by their position in the machine (region and
+# subvertex indices), which is stable between runs on the same model.
+#
+# mdcnvt keeps the fingerprints of the machines it generated in
+# <outdir>/mdcnvt.fp and regenerates only the machines that changed.
+
+import os
+import hashlib
+
+import uml2
+from mdindex import fold
+
+# mdcnvt.fp files of another format are ignored, so all machines are
+# regenerated: bump this when the fingerprint or the generated code changes.
+fprint_format = 3
+
+def digest(tag, *parts):
+    "SHA-1 hex digest of tag and parts (strings, numbers or None)."
+    h = hashlib.sha1(tag)
+    for p in parts:
+        if p == None: p = '\1'
+        elif isinstance(p, unicode): p = p.encode('utf-8')
+        else: p = str(p)
+        h.update('\0' + p)
+    return h.hexdigest()
+
+def str_list(v):
+    # bodies are lists of strings for expressions, strings for behaviors
+    if isinstance(v, list): return '\2'.join([unicode(s) for s in v])
+    return v
+
+class Fingerprinter:
+    """
+    Usage:
+      fp = Fingerprinter()
+      d = fp.machine(stm)               # hex digest for uml2.StateMachine
+    Fingerprints of submachines are kept, so use one Fingerprinter for
+    all machines of a model.
+    """
+
+    def __init__(self):
+        self.memo = {}                  # StateMachine -> digest
+
+    def machine(self, stm):
+        memo = self.memo
+        if memo.has_key(stm):
+            if memo[stm] == None:       # submachine cycle
+                return digest('cycle', stm.name)
+            return memo[stm]
+        memo[stm] = None
+        # Walk down first: positions of all vertices, then digests from
+        # the leaves up (iterative: nesting can be deep).
+        paths = {}
+        order = []
+        stack = []
+        for i in range(len(stm.region)):
+            stack.append((stm.region[i], '%d' % i))
+        while stack:
+            obj, path = stack.pop()
+            paths[obj] = path
+            order.append(obj)
+            if isinstance(obj, uml2.Region):
+                for j in range(len(obj.subvertex)):
+                    stack.append((obj.subvertex[j], '%s.%d' % (path, j)))
+            elif isinstance(obj, uml2.State):
+                for j in range(len(obj.region)):
+                    stack.append((obj.region[j], '%s/%d' % (path, j)))
+                for j in range(len(obj.connection)):
+                    paths[obj.connection[j]] = '%s:%d' % (path, j)
+        for j in range(len(stm.connectionPoint)):
+            paths[stm.connectionPoint[j]] = 'cp%d' % j
+        dg = {}
+        order.reverse()
+        for obj in order:
+            if isinstance(obj, uml2.Region):
+                dg[obj] = self.region(obj, dg, paths)
+            else:
+                dg[obj] = self.vertex(obj, dg, paths)
+        parts = [self.vertex(cp, dg, paths) for cp in stm.connectionPoint]
+        parts.extend([dg[r] for r in stm.region])
+        res = digest('StateMachine', stm.name, *parts)
+        memo[stm] = res
+        return res
+
+    def region(self, region, dg, paths):
+        parts = [dg[v] for v in region.subvertex]
+        parts.extend([self.transition(t, paths) for t in region.transition])
+        return digest('Region', region.name, *parts)
+
+    def vertex(self, vtx, dg, paths):
+        tag = vtx.__class__.__name__
+        if isinstance(vtx, uml2.Pseudostate):
+            return digest(tag, vtx.name, vtx.kind)
+        if not isinstance(vtx, uml2.State):
+            return digest(tag, vtx.name)
+        parts = [self.behavior(vtx.entry), self.behavior(vtx.exit),
+                 self.behavior(vtx.doActivity),
+                 self.constraint(vtx.stateInvariant)]
+        parts.extend([self.trigger(t) for t in vtx.deferrableTrigger])
+        parts.extend([dg[r] for r in vtx.region])
+        if vtx.submachine:
+            parts.append(self.machine(vtx.submachine))
+        for con in vtx.connection:
+            parts.append(digest('connection', con.name, *[
+                paths.get(p, p.name) for p in con.entry + con.exit]))
+        return digest(tag, vtx.name, *parts)
+
+    def transition(self, trn, paths):
+        parts = [trn.kind, self.end(trn.source, paths),
+                 self.end(trn.target, paths),
+                 self.constraint(trn.guard), self.behavior(trn.effect)]
+        parts.extend([self.trigger(t) for t in trn.trigger])
+        return digest('Transition', trn.name, *parts)
+
+    def end(self, vtx, paths):
+        if vtx == None: return None
+        return paths.get(vtx, vtx.name)
+
+    def trigger(self, trg):
+        evt = trg.event
+        if isinstance(evt, uml2.SignalEvent):
+            sig = evt.signal
+            if sig == None: return digest('SignalEvent', None)
+            return digest('SignalEvent', sig.name, len(sig.ownedAttribute))
+        if isinstance(evt, uml2.TimeEvent):
+            return digest('TimeEvent', evt.isRelative, evt.when)
+        if evt == None: return digest('Trigger', trg.name)
+        return digest(evt.__class__.__name__, getattr(evt, 'name', None))
+
+    def constraint(self, con):
+        if con == None: return None
+        if not isinstance(con, uml2.Constraint):
+            return digest('guard', con)  # string guard
+        spec = con.specification
+        if spec == None: return digest('Constraint', con.name)
+        return digest('Constraint', con.name,
+                      str_list(getattr(spec, 'body', None)),
+                      str_list(getattr(spec, 'language', None)))
+
+    def behavior(self, beh):
+        if beh == None: return None
+        return digest(beh.__class__.__name__, getattr(beh, 'name', None),
+                      str_list(getattr(beh, 'body', None)),
+                      str_list(getattr(beh, 'language', None)))
+
+def fprint_path(outdir):
+    return os.path.join(outdir, 'mdcnvt.fp')
+
+def read_fprints(path):
+    """
+    Return dict machine name -> fingerprint from path; empty if there is
+    no file or it was written by another version.
+    """
+    fps = {}
+    try:
+        f1 = open(path)
+    except IOError:
+        return fps
+    try:
+        hdr = f1.readline().rstrip('\n').split('\t')
+        if hdr != ['ssk1-fprint', str(fprint_format)]:
+            return fps
+        for line in f1:
+            name, fp = line.rstrip('\n').split('\t')
+            fps[name.decode('utf-8')] = fp
+    finally:
+        f1.close()
+    return fps
+
+def write_fprints(path, fps):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    f1 = open(tmp, 'w')
+    f1.write("ssk1-fprint\t%d\n" % (fprint_format,))
+    for name in sorted(fps.keys()):
+        f1.write("%s\t%s\n" % (fold(name), fps[name]))
+    f1.close()
+    os.rename(tmp, path)
+
+# --- last line of mdfprint.py ---
@@ -0,0 +1,363 @@
+# mdindex.py - byte-offset index of packagedElements in model XML
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# One pass over the model XML (pyexpat, no handler tree) records for each
+# packagedElement of the Model, and of every Package below it, the byte
+# offsets of the element, of the end of its start tag, its xmi:id,
+# xmi:type and name.  The index is kept in a sidecar file, <file>.idx,
+# stamped with the size and mtime of <file>.
+#
+# read_machines() then cuts a small document out of the model: the XML
+# head (up to the end of the root start tag), the Model start tag, the
+# start tags of enclosing Packages and the elements themselves, and runs
+# it through the usual handlers with a MachineSelection.  Idrefs left
+# missing (signals, events, submachines) name more elements to cut, and
+# we go again until none are left.
+#
+# Offsets are into the model XML, so for .mdzip files that is the
+# decompressed member; zip members can't seek, so the bytes before a
+# slice are decompressed and dropped, which is cheap next to parsing.
+#
+# Expat reports the byte index of the start of each event.  The end of
+# a start tag or of an element is taken as the index of the next event.
+
+import os
+import xml.parsers.expat
+
+from mdreader import open_model, MagicdrawFileHdlr, ExpatDocumentHandler, \
+     MachineSelection, prune_model, msgI
+
+index_format = 1
+
+class IndexEntry:
+
+    def __init__(self, num, beg, parent, xid, xtype, name):
+        self.num = num                  # position in index
+        self.beg = beg                  # byte offset of start tag
+        self.tagend = None              # byte offset of end of start tag
+        self.end = None                 # byte offset of end of element
+        self.parent = parent            # num of enclosing Package or None
+        self.xid = xid                  # xmi:id
+        self.xtype = xtype              # xmi:type
+        self.name = name
+
+class ModelIndex:
+    """
+    Usage:
+      idx = load_index(filename)     # build or read <filename>.idx
+      mdh = read_machines(filename, ['Mach1'])
+    """
+
+    def __init__(self):
+        self.stamp = None               # (size, mtime) of model file
+        self.head = None                # (beg, tagend, qname) of root elt
+        self.model = None               # (beg, tagend, qname) of uml:Model
+        self.entries = []
+        self.byid = {}
+
+    def add(self, entry):
+        self.entries.append(entry)
+        if entry.xid: self.byid[entry.xid] = entry
+
+    def lookup(self, name, xtype='uml:StateMachine'):
+        "Return entries with name and xmi:type."
+        return [e for e in self.entries if e.name == name and e.xtype == xtype]
+
+    def extract(self, filename, want):
+        """
+        Return XML document with the elements in want (list of entries)
+        and the start tags of the Model and Packages enclosing them.
+        """
+        need = {}
+        for e in want:
+            need[e.num] = e
+            while e.parent != None:
+                e = self.entries[e.parent]
+                need.setdefault(e.num, None) # only start tag
+        spans = [(0, self.head[1]), (self.model[0], self.model[1])]
+        tails = []                      # ends of open Packages
+        skip = 0                        # end of last full element
+        for num in sorted(need.keys()):
+            e = self.entries[num]
+            if e.beg < skip: continue   # inside element already taken
+            while tails and e.beg >= tails[-1]:
+                spans.append('</packagedElement>')
+                tails.pop()
+            if need[num]:
+                spans.append((e.beg, e.end))
+                skip = e.end
+            else:
+                spans.append((e.beg, e.tagend))
+                tails.append(e.end)
+        spans.extend(['</packagedElement>'] * len(tails))
+        spans.append('</%s></%s>' % (self.model[2], self.head[2]))
+        return read_spans(filename, spans)
+
+    def write(self, path):
+        f1 = open(path, 'w')
+        f1.write("ssk1-mdindex\t%d\t%d\t%d\n" % \
+                     ((index_format,) + self.stamp))
+        f1.write("head\t%d\t%d\t%s\n" % self.head)
+        f1.write("model\t%d\t%d\t%s\n" % self.model)
+        for e in self.entries:
+            if e.parent == None: parent = -1
+            else: parent = e.parent
+            f1.write("%d\t%d\t%d\t%d\t%s\t%s\t%s\n" % \
+                         (e.beg, e.tagend, e.end, parent, fold(e.xid or ''),
+                          fold(e.xtype or ''), fold(e.name or '')))
+        f1.close()
+
+def fold(name):
+    return name.replace('\t', ' ').replace('\n', ' ').encode('utf-8')
+
+def read_spans(filename, spans):
+    """
+    Return concatenation of spans, each a literal string or a (beg, end)
+    byte range of the model XML.  Ranges must be in order.
+    """
+    f1 = open_model(filename)
+    out = []
+    pos = 0
+    try:
+        for span in spans:
+            if isinstance(span, basestring):
+                out.append(span)
+                continue
+            beg, end = span
+            if isinstance(f1, file):
+                f1.seek(beg)
+            else:
+                while pos < beg:
+                    pos += len(f1.read(min(beg - pos, 1 << 16)))
+            out.append(f1.read(end - beg))
+            pos = end
+    finally:
+        f1.close()
+    return ''.join(out)
+
+class Indexer:
+    """
+    Build ModelIndex for an XML stream.
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self):
+        self.index = ModelIndex()
+        self.stack = []                 # Package entries, None for root/Model
+        self.skip_depth = 0             # depth below element not indexed
+        self.skip_entry = None          # entry being skipped, if any
+        self.pending = []               # (obj, attr) to set at next event
+        p = xml.parsers.expat.ParserCreate()
+        p.StartElementHandler = self.startElement
+        p.EndElementHandler = self.endElement
+        self.parser = p
+
+    def wait(self, obj, attr):
+        # Set obj.attr at the next event.  Character data is only
+        # watched while something is waiting: most of it is not.
+        if not self.pending:
+            self.parser.CharacterDataHandler = self.characters
+            self.parser.CommentHandler = self.characters
+        self.pending.append((obj, attr))
+
+    def mark(self):
+        # end of the last tag is the start of this event
+        p = self.parser
+        pos = p.CurrentByteIndex
+        for obj, attr in self.pending:
+            if isinstance(obj, list): obj[attr] = pos
+            else: setattr(obj, attr, pos)
+        self.pending = []
+        p.CharacterDataHandler = None
+        p.CommentHandler = None
+
+    # Only the root, the Model and Packages can hold indexed elements.
+    # Below anything else we just count depth (as ExpatDocumentHandler
+    # does for skipped subtrees) until the matching end tag.
+
+    def startElement(self, tag, attrs):
+        if self.pending: self.mark()
+        pos = self.parser.CurrentByteIndex
+        index = self.index
+        stack = self.stack
+        if not stack:
+            index.head = [pos, None, tag]
+            self.wait(index.head, 1)
+            stack.append(None)
+            return
+        if tag == 'uml:Model' and index.model == None:
+            index.model = [pos, None, tag]
+            self.wait(index.model, 1)
+            stack.append(None)
+            return
+        entry = None
+        if tag == 'packagedElement' and len(stack) > 1:
+            if stack[-1] == None: parent = None
+            else: parent = stack[-1].num
+            entry = IndexEntry(len(index.entries), pos, parent,
+                               attrs.get('xmi:id', None),
+                               attrs.get('xmi:type', None),
+                               attrs.get('name', None))
+            index.add(entry)
+            self.wait(entry, 'tagend')
+            if entry.xtype == 'uml:Package':
+                stack.append(entry)
+                return
+        self.beginSkip(entry)
+
+    def endElement(self, tag):
+        if self.pending: self.mark()
+        entry = self.stack.pop()
+        if entry: self.wait(entry, 'end')
+
+    def beginSkip(self, entry):
+        p = self.parser
+        self.skip_depth = 1
+        self.skip_entry = entry
+        p.StartElementHandler = self.skipStart
+        p.EndElementHandler = self.skipEnd
+
+    def skipStart(self, tag, attrs):
+        if self.pending: self.mark()
+        self.skip_depth += 1
+
+    def skipEnd(self, tag):
+        if self.pending: self.mark()
+        self.skip_depth -= 1
+        if self.skip_depth > 0: return
+        p = self.parser
+        p.StartElementHandler = self.startElement
+        p.EndElementHandler = self.endElement
+        if self.skip_entry: self.wait(self.skip_entry, 'end')
+
+    def characters(self, data):
+        if self.pending: self.mark()
+
+    def parseFile(self, f1):
+        parser = self.parser
+        while True:
+            buf = f1.read(self.chunk_size)
+            if not buf: break
+            parser.Parse(buf, False)
+        parser.Parse('', True)
+        index = self.index
+        # tag names from expat are unicode; keep str, as read_index gives
+        index.head = tuple(index.head[:2]) + (index.head[2].encode('utf-8'),)
+        index.model = tuple(index.model[:2]) + \
+            (index.model[2].encode('utf-8'),)
+        del self.parser                 # break cycle parser <-> self
+        return index
+
+def file_stamp(filename):
+    st = os.stat(filename)
+    return (st.st_size, int(st.st_mtime))
+
+def index_path(filename):
+    return filename + '.idx'
+
+def build_index(filename):
+    "Build ModelIndex for .mdzip, .mdxml or XMI file."
+    f1 = open_model(filename)
+    try:
+        index = Indexer().parseFile(f1)
+    finally:
+        f1.close()
+    index.stamp = file_stamp(filename)
+    return index
+
+def read_index(path):
+    "Read index from sidecar file.  Return None if unreadable."
+    index = ModelIndex()
+    try:
+        f1 = open(path)
+    except IOError:
+        return None
+    try:
+        hdr = f1.readline().rstrip('\n').split('\t')
+        if hdr[0] != 'ssk1-mdindex' or int(hdr[1]) != index_format:
+            return None
+        index.stamp = (int(hdr[2]), int(hdr[3]))
+        for attr in ('head', 'model'):
+            fs = f1.readline().rstrip('\n').split('\t')
+            setattr(index, attr, (int(fs[1]), int(fs[2]), fs[3]))
+        for line in f1:
+            fs = line.rstrip('\n').split('\t')
+            parent = int(fs[3])
+            if parent < 0: parent = None
+            e = IndexEntry(len(index.entries), int(fs[0]), parent,
+                           fs[4] or None, fs[5] or None,
+                           fs[6].decode('utf-8') or None)
+            e.tagend = int(fs[1])
+            e.end = int(fs[2])
+            index.add(e)
+    finally:
+        f1.close()
+    return index
+
+def load_index(filename, verbose=False):
+    """
+    Return ModelIndex for filename, from the sidecar file if that is up
+    to date, else built (and the sidecar file written).
+    """
+    path = index_path(filename)
+    index = read_index(path)
+    if index and index.stamp == file_stamp(filename):
+        return index
+    if verbose: msgI("indexing %s" % filename)
+    index = build_index(filename)
+    try:
+        index.write(path)
+    except IOError:
+        if verbose: msgI("could not write %s" % path)
+    return index
+
+def read_machines(filename, machs, verbose=False):
+    """
+    Like mdreader.read_model(filename, machs=machs) but parses only the
+    slices of the model XML holding the machines (and the signals, events
+    and submachines they reference), found from the index.
+    """
+    index = load_index(filename, verbose)
+    want = set()
+    for name in machs:
+        es = index.lookup(name)
+        if not es:
+            raise Exception, "no StateMachine %s in %s" % (name, filename)
+        want.update(es)
+    select = MachineSelection(machs)
+    while True:
+        select.ids |= set([e.xid for e in want])
+        select.missing = set()
+        mdh = MagicdrawFileHdlr(select)
+        buf = index.extract(filename, want)
+        if verbose: msgI("parsing %d of %d elements, %d bytes" % \
+                             (len(want), len(index.entries), len(buf)))
+        ExpatDocumentHandler(mdh).parse(buf)
+        if not select.missing: break
+        new = set()
+        for xid in select.missing:
+            e = index.byid.get(xid, None)
+            if e and e not in want: new.add(e)
+        if not new:
+            raise Exception, "unresolved idrefs: %s" % list(select.missing)
+        want |= new
+    mdh.patchup()
+    prune_model(mdh.model)
+    return mdh
+
+# --- last line of mdindex.py ---
@@ -76,16 +76,20 @@ import xml.sax
 # desired.  (I am trying to eliminate env. -- Matt)
 
 # XMI documents use references (given as attributes).   This parser
-# tracks these references and provides an opportunity to trace through
-# the references once the file has been read.  The method deref() can
-# be redefined by any node.  This node should always call deref_kids()
-# after all local references have been dealt with.
+# tracks these references: when a handler sees an idref it registers it
+# with ref(obj, attr, idref), in a flat list shared by all handlers of the
+# document.  Once the file has been read resolve() goes through the list
+# once and fills in obj.attr (or appends to obj, if a list) with the uml2
+# value for idref.  References that don't resolve are reported together,
+# with the xmi:id of the element they came from.
 
 # When the sax document handler parses a xml element with "xmi:id" tag
 # it adds the element to the xmi dictionary.
 
-# xmidict is a dictionary with keys being XMI ID's (unicode) and values
-# being class instances from uml2.py. 
+# xmidict maps XMI ID's (unicode) to class instances from uml2.py.  It is
+# an XmiIdTable, not a dictionary: each id is interned to a small integer
+# when first seen (as xmi:id or as idref) and the values are kept in a list
+# indexed by that.  Pending references hold the integer, not the string.
 
 # UML values must be instantiated in constructors.  For example, this works:
 #   el = Constraint(self, tag, attrs)
@@ -99,15 +103,18 @@ class LtWtHdlr:
        If endEltIn sees it's own tag it should return the parent ("return
        self.parent").
        Element passes environment .env to children.
+       If parent.keep_tree is false the handler is not entered in
+       parent.children, so it is dropped as soon as its element closes.
     """
     tag = 'LtWtHdlr'
+    keep_tree = True                    # keep handler tree (children)
 
     def __init__(self, parent, tag, attrs):
         self.parent = parent
         self.children = []
         self.tag = tag
-        self.data = ""
-        if parent:
+        self.data = []                  # text pieces, see get_data()
+        if parent and parent.keep_tree:
             parent.children.append(self)
         #    self.env = parent.env
         #else:
@@ -124,50 +131,184 @@ class LtWtHdlr:
             return self
 
     def charsIn(self, data):
-        #self.data += data
-        self.data += str(data)  # convert to ascii -- OK?
+        # Pieces are collected in a list and joined in get_data(); repeated
+        # string concatenation is quadratic on long bodies.
+        self.data.append(data)
+
+    def get_data(self):
+        return str(''.join(self.data))  # convert to ascii -- OK?
+
+
+# kinds of reference for XmiElement.ref()
+ref_must = 0                            # must be in xmidict
+ref_sel = 1                             # may be outside selected machines
+ref_opt = 2                             # same, but drop (not noted missing)
+ref_mark = 3                            # set attr True on value, if any
+
+xmi_undef = object()                    # value of id not (yet) defined
+
+class XmiIdTable:
+    """
+    XMI ids interned to dense ints: index[name] is the int for id name,
+    vals[i] the value for it (xmi_undef until defined) and names[i] the
+    id string, kept for messages.  Has the dictionary methods mdreader
+    used on xmidict.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.vals = []
+
+    def intern(self, name):
+        i = self.index.get(name, None)
+        if i == None:
+            i = len(self.names)
+            self.index[name] = i
+            self.names.append(name)
+            self.vals.append(xmi_undef)
+        return i
+
+    def has_key(self, name):
+        i = self.index.get(name, None)
+        return i != None and self.vals[i] is not xmi_undef
+
+    __contains__ = has_key
+
+    def get(self, name, default=None):
+        i = self.index.get(name, None)
+        if i == None or self.vals[i] is xmi_undef: return default
+        return self.vals[i]
+
+    def __getitem__(self, name):
+        val = self.get(name, xmi_undef)
+        if val is xmi_undef: raise KeyError, name
+        return val
+
+    def __setitem__(self, name, val):
+        self.vals[self.intern(name)] = val
+
+    def __len__(self):
+        return len(self.vals) - self.vals.count(xmi_undef)
+
+
+# Everything that belongs to one parse lives in a ParseSession, shared by
+# all handlers of the document (handler.session), so documents can be
+# parsed one after another, or in threads, without state carrying over.
+
+class ParseSession:
+    """
+    Per-parse state: the XMI id table, pending references, the machine
+    selection (if any), ids of used diagram objects and elements, and
+    the XmiExtension handler classes.
+    """
+
+    def __init__(self, select=None, extensions=()):
+        self.xmidict = XmiIdTable()
+        self.refs = []                  # pending references, see ref()
+        self.select = select            # MachineSelection, see below
+        self.skipped = set()            # interned ids the selection skipped
+        self.uzob = []                  # usedObjects ids (diagrams)
+        self.uzel = []                  # usedElements ids (diagrams)
+        self.extensions = list(extensions) # classes, see XmiExtension
+
+    def add_extension(self, extension):
+        self.extensions.append(extension)
+
+    def resolve(self):
+        "Resolve references registered w/ XmiElement.ref(), in order."
+        ids = self.xmidict
+        vals = ids.vals
+        select = self.select
+        bad = []
+        for xid, obj, attr, i, kind in self.refs:
+            val = vals[i]
+            if kind == ref_mark:
+                if val is not xmi_undef and val != None:
+                    setattr(val, attr, True)
+                continue
+            if val is xmi_undef:
+                if not select or kind == ref_must:
+                    bad.append((xid, attr, i))
+                    continue
+                if kind == ref_opt: continue
+                # selective load, ref_sel: noted missing
+                val = None
+                select.missing.add(ids.names[i])
+            elif val == None and select and kind == ref_sel and \
+                    i in self.skipped:
+                # skipped by the selection; other Nones are so in a full
+                # load too.  read_model parses again w/ missing ids selected.
+                select.missing.add(ids.names[i])
+            if isinstance(obj, list): obj.append(val)
+            else: setattr(obj, attr, val)
+        self.refs = []
+        if bad:
+            names = ids.names
+            bad = [(xid >= 0 and names[xid] or '?', attr, names[i])
+                   for xid, attr, i in bad]
+            lines = ["  %s: %s -> %s" % b for b in bad[:20]]
+            if len(bad) > 20: lines.append("  ...")
+            raise Exception, "%d unresolved idref(s):\n%s" % \
+                (len(bad), "\n".join(lines))
 
 
 class XmiElement(LtWtHdlr):
     """
     The XMI dictionary uses XMI tags with unicode strings (as returned
-    by the SAX parser).  Strategy: put potential xmi:idrefs in the handler
-    instance (i.e., if attrs has source='_123456' then self.source=xxx)
+    by the SAX parser).  Strategy: register xmi:idrefs with ref() (i.e., if
+    attrs has source='_123456' then self.ref(self.val, 'source', '_123456'))
     otherwise stuff information in the vals right away.
     Check: Does xmi element need to have a xmi:id and/or xmi:type?
     """
     tag = 'xmi:Element'
 
     def __init__(self, parent, tag, attrs):
-        LtWtHdlr.__init__(self, parent, tag, attrs)
+        # LtWtHdlr.__init__, inline: this runs for every element
+        self.parent = parent
+        self.children = []
+        self.tag = tag
+        self.data = []
+        self.val = None
+        if parent and parent.keep_tree:
+            parent.children.append(self)
+        self.xmiId = attrs.get('xmi:id', None)
         if not parent:
-            self.xmidict = {}
+            self.session = ParseSession()
         else:
-            self.xmidict = parent.xmidict
+            self.session = parent.session
+            self.keep_tree = parent.keep_tree
 
     def xmi_insert_val(self, name):
-        if self.xmidict.has_key(name): raise Exception
-        self.xmidict[name] = self.val
+        xmidict = self.session.xmidict
+        if xmidict.has_key(name): raise Exception
+        val = self.val
+        xmidict[name] = val
+        if isinstance(val, uml2.Element): val.xmi_id = name
         if 0: print "xmidict: add key", name
 
     def xmi_lookup(self, name):
-        if self.xmidict.has_key(name):
-            return self.xmidict[name]
+        xmidict = self.session.xmidict
+        if xmidict.has_key(name):
+            return xmidict[name]
         else:
             raise Exception
 
-    def deref_kids(self):
-        for c in self.children:
-            c.deref()
-
-    def deref(self):
-        self.deref_kids()
+    def ref(self, obj, attr, idref, kind=ref_must):
+        """
+        Register reference: after the parse obj.attr is set to the value
+        for idref (or, if obj is a list, the value is appended to it and
+        attr is only used in messages).  See ref_must etc above for kind.
+        """
+        session = self.session
+        intern = session.xmidict.intern
+        xid = self.xmiId
+        if xid: xid = intern(xid)
+        else: xid = -1
+        session.refs.append((xid, obj, attr, intern(idref), kind))
 
 # ... don't really know if this handle for extension is useful ...
-extensions = []                         # list of extension classes
-
-def add_extension(extension):
-    extensions.append(extension)
+# (extension classes are registered w/ session.add_extension)
 
 class XmiExtension(XmiElement):
 
@@ -176,7 +317,7 @@ class XmiExtension(XmiElement):
 
     def begEltIn(self, tag, attrs):
         el = None
-        for ext in extensions:
+        for ext in self.session.extensions:
             if tag == ext.tag:
                 el = ext(self, attrs)
         return el
@@ -257,7 +398,7 @@ class XmiDocumentHandler(xml.sax.ContentHandler):
         hdlr = self.hdlr
         if hdlr != self.hchk: raise Exception, "unbalanced parse"
         hdlr.endEltIn(hdlr.tag)
-        hdlr.deref()
+        hdlr.session.resolve()
         del self.hdlr
         del self.hchk
 
@@ -265,6 +406,158 @@ class XmiDocumentHandler(xml.sax.ContentHandler):
         print self.istr[:self.lvl] + str
 
 
+# The fast path: same document handler, but driven by pyexpat directly.
+# The xml.sax reader wraps every callback (and builds an AttributesImpl for
+# every element); here expat calls our methods with a plain dict of attrs.
+# Character data is buffered by expat so we get one call per text run.
+
+import xml.parsers.expat
+
+class ExpatLocator:
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def getLineNumber(self):
+        return self.parser.CurrentLineNumber
+
+    def getColumnNumber(self):
+        return self.parser.CurrentColumnNumber
+
+# SkipElement subtrees: once a handler returns a SkipElement we swap the
+# expat handlers for a depth counter (and drop character data altogether)
+# until the matching end tag, so nothing in the subtree reaches begEltIn,
+# charsIn or the handler tree.  Ids inside skipped subtrees are not entered
+# in xmidict.  Counts of skipped bytes and elements are kept for reporting.
+
+# start tag at the head of GetInputContext(); '>' may be in quoted values
+skip_stag_re = re.compile(r'''<[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>''')
+
+class ExpatDocumentHandler(XmiDocumentHandler):
+    """
+    Usage:
+      h = ExpatDocumentHandler(MagicdrawFileHdlr())
+      h.parse(buf)             # or h.parseFile(f1)
+      print h.skip_report()
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self, handler):
+        XmiDocumentHandler.__init__(self, handler)
+        p = xml.parsers.expat.ParserCreate()
+        p.buffer_text = True
+        p.StartElementHandler = self.startElement
+        p.EndElementHandler = self.endElement
+        p.CharacterDataHandler = self.characters
+        self.parser = p
+        self.setDocumentLocator(ExpatLocator(p))
+        self.nbyte = 0                  # bytes parsed
+        self.nelt = 0                   # elements parsed
+        self.skip_depth = 0             # depth in skipped subtree
+        self.skip_beg = 0               # byte index of skipped subtree
+        self.skip_elen = 0              # its tag length if empty, else 0
+        self.skip_nbyte = 0             # bytes in skipped subtrees
+        self.skip_nelt = 0              # elements in skipped subtrees
+        self.skip_ntree = 0             # number of skipped subtrees
+
+    def parse(self, buf):
+        self.nbyte = len(buf)
+        self.parser.Parse(buf, True)
+        self.endDocument()
+
+    def parseFile(self, f1):
+        # Feed the parser in fixed-size chunks so only one chunk of the
+        # raw XML is held at a time (f1 may be a stream out of a zipfile).
+        parser = self.parser
+        chunk_size = self.chunk_size
+        while True:
+            buf = f1.read(chunk_size)
+            if not buf: break
+            self.nbyte += len(buf)
+            parser.Parse(buf, False)
+        parser.Parse('', True)
+        self.endDocument()
+
+    # start/end/characters are XmiDocumentHandler's, w/o the debug
+    # printing and one call less per element (or text run).  charsIn is
+    # LtWtHdlr's for all handlers, so text goes straight to hdlr.data.
+
+    def startElement(self, tag, attrs):
+        self.nelt += 1
+        el = self.hdlr.begEltIn(tag, attrs)
+        if el:
+            self.hdlr = el
+            if attrs.has_key('xmi:id'):
+                id = attrs['xmi:id']
+                el.xmi_insert_val(id)
+                el.xmiId = id
+            if isinstance(el, SkipElement):
+                self.beginSkip()
+
+    def endElement(self, tag):
+        hdlr = self.hdlr.endEltIn(tag)
+        if not hdlr:
+            raise Exception, "no handler from %s at %d" \
+                % (tag, self.parser.CurrentLineNumber)
+        self.hdlr = hdlr
+
+    def characters(self, data):
+        self.hdlr.data.append(data)
+
+    def beginSkip(self):
+        p = self.parser
+        self.skip_depth = 1
+        self.skip_beg = p.CurrentByteIndex
+        self.skip_ntree += 1
+        self.skip_nelt += 1
+        # The end of an empty element (<x .../>) is reported after its
+        # tag, else at the start of the end tag: keep the tag if empty.
+        stag = skip_stag_re.match(p.GetInputContext()).group()
+        if stag[-2:] == '/>':
+            self.skip_elen = len(stag)
+        else:
+            self.skip_elen = 0
+        p.StartElementHandler = self.skipStart
+        p.EndElementHandler = self.skipEnd
+        p.CharacterDataHandler = None
+
+    def skipStart(self, tag, attrs):
+        self.skip_depth += 1
+        self.skip_nelt += 1
+
+    def skipEnd(self, tag):
+        self.skip_depth -= 1
+        if self.skip_depth > 0: return
+        p = self.parser
+        if self.skip_elen:
+            self.skip_nbyte += self.skip_elen
+        else:
+            # CurrentByteIndex is the start of the end tag: add the tag
+            etag = p.GetInputContext()
+            self.skip_nbyte += p.CurrentByteIndex - self.skip_beg \
+                + etag.index('>') + 1
+        p.StartElementHandler = self.startElement
+        p.EndElementHandler = self.endElement
+        p.CharacterDataHandler = self.characters
+        self.endElement(tag)            # pops the SkipElement
+
+    def endDocument(self):
+        XmiDocumentHandler.endDocument(self)
+        self.nelt += self.skip_nelt - self.skip_ntree
+        del self.parser                 # break cycle parser <-> self
+        self._locator = None
+
+    def skip_report(self):
+        "Return a line reporting how much of the document was skipped."
+        pb = 100.0 * self.skip_nbyte / max(self.nbyte, 1)
+        pe = 100.0 * self.skip_nelt / max(self.nelt, 1)
+        return "skipped %d subtrees: %d of %d bytes (%.1f%%)," \
+            " %d of %d elements (%.1f%%)" % \
+            (self.skip_ntree, self.skip_nbyte, self.nbyte, pb,
+             self.skip_nelt, self.nelt, pe)
+
+
 # =============================================================================
 
 import uml2
@@ -338,24 +631,24 @@ class Behavior(XmiElement):
     def begEltInFunctionBehavior(self, tag, attrs):
         el = None
         if tag == 'body':
-            self.data = ""
+            self.data = []
 
     def endEltInFunctionBehavior(self, tag):
         if tag == self.tag: return self.parent
         if tag == 'body':
-            self.val.body = self.data
+            self.val.body = self.get_data()
         return self
 
     # OpaqueBehavior =====================
     def begEltInOpaqueBehavior(self, tag, attrs):
         el = None
         if tag == 'body':
-            self.data = ""
+            self.data = []
 
     def endEltInOpaqueBehavior(self, tag):
         if tag == self.tag: return self.parent
         if tag == 'body':
-            self.val.body = self.data
+            self.val.body = self.get_data()
         return self
 
 
@@ -435,18 +728,17 @@ class Region(XmiElement):
             print "Region: unknown tag?"
         return el
 
-    def deref(self):
-        self.deref_kids()
-
 
 class Trigger(XmiElement):
 
     def __init__(self, parent, tag, attrs):
         XmiElement.__init__(self, parent, tag, attrs)
         self.val = uml2.Trigger()
-        self.event = attrs.get('event', None)
+        event = attrs.get('event', None)
         #print "T:", attrs['xmi:id'], self.val
-        if self.event == None:
+        if event:
+            self.ref(self.val, 'event', event, ref_sel)
+        else:
             #print "mdreader.Trigger: no event", attrs['xmi:id']
             pass
 
@@ -458,10 +750,6 @@ class Trigger(XmiElement):
             print "unhandled tag \"" + tag + "\" in " + self.tag
         return el
 
-    def deref(self):
-        if self.event: self.val.event = self.xmidict[self.event]
-        self.deref_kids()
-
 
 class Transition(XmiElement):
 
@@ -474,21 +762,21 @@ class Transition(XmiElement):
         if attrs.has_key('name'): val.name = str(attrs['name'])
         #
         # idrefs ...
-        self.source = attrs.get('source', None)
-        self.target = attrs.get('target', None)
-        self.trigger = []
-        self.guard = attrs.get('guard', None)
+        if attrs.has_key('source'): self.ref(val, 'source', attrs['source'])
+        if attrs.has_key('target'): self.ref(val, 'target', attrs['target'])
+        if attrs.has_key('guard'):      # MD17: ownedRule
+            self.ref(val, 'guard', attrs['guard'], ref_sel)
         self.effect = attrs.get('effect', None)
+        if self.effect: self.ref(val, 'effect', self.effect, ref_sel)
 
     def begEltIn(self, tag, attrs):
         el = None
         if tag == 'source':
-            self.source = attrs['xmi:idref']
+            self.ref(self.val, 'source', attrs['xmi:idref'])
         elif tag == 'target':
-            self.target = attrs['xmi:idref']
+            self.ref(self.val, 'target', attrs['xmi:idref'])
         elif tag == 'trigger':
             el = Trigger(self, tag, attrs)
-            el.event = attrs.get('event', None)
             self.val.trigger.append(el.val)
         elif tag == 'ownedRule':
             el = Constraint(self, tag, attrs)
@@ -504,16 +792,6 @@ class Transition(XmiElement):
             print "*** mdreader: unhandled tag \"" + tag + "\" in " + self.tag
         return el
 
-    def deref(self):
-        val = self.val
-        xmidict = self.xmidict
-        if self.source: self.val.source = xmidict[self.source]
-        if self.target: self.val.target = xmidict[self.target]
-        for trg in self.trigger: val.trigger.append(xmidict[trg])
-        if self.guard: val.guard = xmidict[self.guard] # MD17: now ownedRule
-        if self.effect: val.effect = xmidict[self.effect]
-        self.deref_kids()
-
 
 # States show up as subvertex tags.  Note that MD10 does not provide
 # the isComposite property.  One must deduce this from regions living
@@ -528,35 +806,22 @@ class Vertex(XmiElement):
         XmiElement.__init__(self, parent, tag, attrs)
         xtype = attrs['xmi:type']
         self.type = xtype
-        self.submachine = False
-        if attrs.has_key('outgoing'):
-            self.outgoing = str(attrs['outgoing']).split(',')
-        else:
-            self.outgoing = []
-        if attrs.has_key('incoming'):
-            self.incoming = str(attrs['incoming']).split(',')
-        else:
-            self.incoming = []
-        if xtype == 'uml:State':
-            # states are simple by default
-            val = uml2.State()
-            if attrs.has_key('submachine'):
-                self.submachine = attrs['submachine']
-                val.isSimple = False
-                val.isSubmachineState = True
-                #print "state is submachine:", val
-        elif xtype == 'uml:Pseudostate':
-            val = uml2.Pseudostate()
-            if attrs.has_key('kind'): val.kind = str(attrs['kind'])
-            #val.stateMachine = XXX	# \todo track statemachine
-            #val.stateMachine.connectionPoint.append(val)
-        elif xtype == 'uml:FinalState':
-            val = uml2.FinalState()	# final state isa State
+        init = self.init_by_type.get(xtype, None)
+        if init:
+            val = init(self, attrs)
         else:
             print "class Vertex: typ=", xtype
             val = None
         val.container = self.parent.val	# parent relationship
         self.val = val
+        if attrs.has_key('outgoing'):
+            for ref in str(attrs['outgoing']).split(','):
+                self.ref(val.outgoing, 'outgoing', ref)
+        if attrs.has_key('incoming'):
+            for ref in str(attrs['incoming']).split(','):
+                self.ref(val.incoming, 'incoming', ref)
+        if attrs.has_key('submachine') and xtype == 'uml:State':
+            self.ref(val, 'submachine', attrs['submachine'], ref_sel)
         if attrs.has_key('name'):
             val.name = str(attrs.get('name'))
             #print "class Vertex: ", val.name
@@ -564,88 +829,115 @@ class Vertex(XmiElement):
             pass
             #print "class Vertex: ", attrs
 
+    def initState(self, attrs):
+        # states are simple by default
+        val = uml2.State()
+        if attrs.has_key('submachine'):
+            val.isSimple = False
+            val.isSubmachineState = True
+            #print "state is submachine:", val
+        return val
+
+    def initPseudostate(self, attrs):
+        val = uml2.Pseudostate()
+        if attrs.has_key('kind'): val.kind = str(attrs['kind'])
+        #val.stateMachine = XXX	# \todo track statemachine
+        #val.stateMachine.connectionPoint.append(val)
+        return val
+
+    def initFinalState(self, attrs):
+        return uml2.FinalState()	# final state isa State
+
     def begEltIn(self, tag, attrs):
-        el = None
-        if tag == 'region':
-            # A Composite state has at least one region.
-            # An orthogonal state has at least two regions.
-            #print "entering " + self.type + "/region"
-            #if self.val.name: print "state/region with name", self.val.name
-            self.val.isSimple = False
-            if self.val.isComposite == True:
-                self.val.isOrthogonal = True
-            else:
-                self.val.isComposite = True
-            if len(self.val.region) > 0: # orthogonal if more than one region
-                self.val.isOrthogonal = True
-            el = Region(self, tag, attrs)
-            self.val.region.append(el.val) # append region
-        elif tag == 'outgoing':
-            # not used in MD17 (was used in MD10)
-            self.outgoing.append(attrs['xmi:idref'])
-        elif tag == 'incoming':
-            # not used in MD17 IMO
-            self.incoming.append(attrs['xmi:idref'])
-        elif tag == 'stateInvariant':
-            el = Constraint(self, tag, attrs)
-            self.val.stateInvariant = el.val
-        elif tag == 'entry':        # \todo: fix kludge using name
-            xtype = attrs.get('xmi:type', None)
-            if not xtype: raise Exception
-            if xtype == 'uml:FunctionBehavior':
-                v = uml2.FunctionBehavior()
-            else:
-                raise Exception
-            v.body = attrs.get('name', None)
-            self.val.entry = v
-        elif tag == 'exit':        # \todo: fix kludge using name
-            # tags: xmi:type, name, xmi:id, ...
-            xtype = attrs.get('xmi:type', None)
-            if not xtype: raise Exception
-            if xtype == 'uml:FunctionBehavior':
-                v = uml2.FunctionBehavior()
-            elif xtype == 'uml:Activity':
-                v = uml2.Activity()
-            else:
-                pdb.set_trace()
-                raise Exception
-            v.body = attrs.get('name', None)
-            self.val.exit = v
-        elif tag == 'doActivity':        # \todo: fix kludge using name
-            # tags: xmi:type, name, xmi:id, ...
-            xtype = attrs.get('xmi:type', None)
-            if not xtyp: raise Exception
-            if xtype == 'uml:FunctionBehavior':
-                v = uml2.FunctionBehavior()
-            else:
-                raise Exception
-            v.body = attrs.get('name', None)
-            self.val.doActivity = v
-        elif tag == 'connection':
-            #This is inside <subvertex>...
-            #<connection xmi:type='uml:ConnectionPointReference' xmi:id='...'
-            # visibility='public'>
-            # <entry xmi:idref='...'/>
-            #</connection>
-            el = ConnectionPointReference(self, tag, attrs)
-            if self.type != 'uml:State': raise Exception
-            self.val.connection.append(el.val)
-        elif tag == 'xmi:Extension':
-            pass
-        elif tag == 'modelExtension':
-            pass
+        begx = self.beg_by_tag.get(tag, None)
+        if begx:
+            return begx(self, tag, attrs)
         elif tag.startswith("diagram"):
             pass
-        elif tag == 'ownedDiagram':
-            pass
-        elif tag == 'binaryObject':
-            pass
         elif tag.startswith("used"):
             pass
         else:
             print "subvertex.begEltIn: unhandled tag:", tag
+        return None
+
+    def begRegion(self, tag, attrs):
+        # A Composite state has at least one region.
+        # An orthogonal state has at least two regions.
+        #print "entering " + self.type + "/region"
+        #if self.val.name: print "state/region with name", self.val.name
+        self.val.isSimple = False
+        if self.val.isComposite == True:
+            self.val.isOrthogonal = True
+        else:
+            self.val.isComposite = True
+        if len(self.val.region) > 0: # orthogonal if more than one region
+            self.val.isOrthogonal = True
+        el = Region(self, tag, attrs)
+        self.val.region.append(el.val) # append region
+        return el
+
+    def begOutgoing(self, tag, attrs):
+        # not used in MD17 (was used in MD10)
+        self.ref(self.val.outgoing, 'outgoing', attrs['xmi:idref'])
+
+    def begIncoming(self, tag, attrs):
+        # not used in MD17 IMO
+        self.ref(self.val.incoming, 'incoming', attrs['xmi:idref'])
+
+    def begStateInvariant(self, tag, attrs):
+        el = Constraint(self, tag, attrs)
+        self.val.stateInvariant = el.val
+        return el
+
+    def begEntry(self, tag, attrs):     # \todo: fix kludge using name
+        xtype = attrs.get('xmi:type', None)
+        if not xtype: raise Exception
+        if xtype == 'uml:FunctionBehavior':
+            v = uml2.FunctionBehavior()
+        else:
+            raise Exception
+        v.body = attrs.get('name', None)
+        self.val.entry = v
+
+    def begExit(self, tag, attrs):      # \todo: fix kludge using name
+        # tags: xmi:type, name, xmi:id, ...
+        xtype = attrs.get('xmi:type', None)
+        if not xtype: raise Exception
+        if xtype == 'uml:FunctionBehavior':
+            v = uml2.FunctionBehavior()
+        elif xtype == 'uml:Activity':
+            v = uml2.Activity()
+        else:
+            pdb.set_trace()
+            raise Exception
+        v.body = attrs.get('name', None)
+        self.val.exit = v
+
+    def begDoActivity(self, tag, attrs): # \todo: fix kludge using name
+        # tags: xmi:type, name, xmi:id, ...
+        xtype = attrs.get('xmi:type', None)
+        if not xtype: raise Exception
+        if xtype == 'uml:FunctionBehavior':
+            v = uml2.FunctionBehavior()
+        else:
+            raise Exception
+        v.body = attrs.get('name', None)
+        self.val.doActivity = v
+
+    def begConnection(self, tag, attrs):
+        #This is inside <subvertex>...
+        #<connection xmi:type='uml:ConnectionPointReference' xmi:id='...'
+        # visibility='public'>
+        # <entry xmi:idref='...'/>
+        #</connection>
+        el = ConnectionPointReference(self, tag, attrs)
+        if self.type != 'uml:State': raise Exception
+        self.val.connection.append(el.val)
         return el
 
+    def begIgnore(self, tag, attrs):
+        return None
+
     def endEltIn(self, tag):
         if tag == self.tag: return self.parent
         if tag == 'stateInvariant':
@@ -653,15 +945,26 @@ class Vertex(XmiElement):
             print "--- mdreader: got stateInvariant:", self.val.stateInvariant
         return self
 
-    def deref(self):
-        val = self.val
-        xmidict = self.xmidict
-        for ref in self.outgoing: val.outgoing.append(xmidict[ref])
-        for ref in self.incoming: val.incoming.append(xmidict[ref])
-        if self.submachine:
-            self.val.submachine = xmidict[self.submachine]
-        self.deref_kids()
-
+    # dispatch tables, keyed by xmi:type and by tag
+    init_by_type = {
+        'uml:State': initState,
+        'uml:Pseudostate': initPseudostate,
+        'uml:FinalState': initFinalState,
+        }
+    beg_by_tag = {
+        'region': begRegion,
+        'outgoing': begOutgoing,
+        'incoming': begIncoming,
+        'stateInvariant': begStateInvariant,
+        'entry': begEntry,
+        'exit': begExit,
+        'doActivity': begDoActivity,
+        'connection': begConnection,
+        'xmi:Extension': begIgnore,
+        'modelExtension': begIgnore,
+        'ownedDiagram': begIgnore,
+        'binaryObject': begIgnore,
+        }
 
 
 class ConnectionPointReference(XmiElement):
@@ -669,32 +972,23 @@ class ConnectionPointReference(XmiElement):
     def __init__(self, parent, tag, attrs):
         XmiElement.__init__(self, parent, tag, attrs)
         self.val = uml2.ConnectionPointReference()
-        self.entry = []
-        self.exit = []
 
     def begEltIn(self, tag, attrs):
         el = None
         if tag == 'entry':
             if attrs.has_key('xmi:idref'):
-                self.entry.append(attrs['xmi:idref'])
+                self.ref(self.val.entry, 'entry', attrs['xmi:idref'], ref_sel)
             else:
                 raise Exception
         elif tag == 'exit':
             if attrs.has_key('xmi:idref'):
-                self.entry.append(attrs['xmi:idref'])
+                self.ref(self.val.exit, 'exit', attrs['xmi:idref'], ref_sel)
             else:
                 raise Exception
         else:
             print "connection.begEltIn: unhandled tag:", tag
         return el
 
-    def deref(self):
-        val = self.val
-        xmidict = self.xmidict
-        for ref in self.entry:
-            val.entry.append(xmidict[ref])
-        self.deref_kids()
-
 
 class OpaqueExpression(XmiElement):
 
@@ -705,7 +999,7 @@ class OpaqueExpression(XmiElement):
     def begEltIn(self, tag, attrs):
         el = None
         if tag == 'body':
-            self.data = ""
+            self.data = []
         elif tag == 'language':
             # ignore
             pass
@@ -716,7 +1010,7 @@ class OpaqueExpression(XmiElement):
     def endEltIn(self, tag):
         if tag == self.tag: return self.parent
         if tag == 'body':
-            self.val.body.append(self.data)
+            self.val.body.append(self.get_data())
         return self
 
 
@@ -763,79 +1057,28 @@ class PackagedElement(XmiElement):      # :PackageableElement
         XmiElement.__init__(self, parent, tag, attrs)
         xtype = attrs['xmi:type']
         self.type = xtype
-
-        if xtype == 'uml:Package':
-            # self.val set in initKlass
-            self.initPackage(parent, tag, attrs)
-        elif xtype == 'uml:StateMachine':
-            self.initStateMachine(parent, tag, attrs)
-        elif xtype == 'uml:Signal':
-            self.initSignal(parent, tag, attrs)
-        elif xtype == 'uml:FunctionBehavior':
-            self.initFunctionBehavior(parent, tag, attrs)
-        elif xtype == 'uml:Enumeration':
-            self.initEnumeration(parent, tag, attrs)
-        elif xtype == 'uml:SignalEvent':
-            self.initSignalEvent(parent, tag, attrs)
-        elif xtype == 'uml:TimeEvent':
-            self.initTimeEvent(parent, tag, attrs)
-        elif xtype == 'uml:LiteralBoolean':
-            pass
-        elif xtype == 'uml:Profile':
-            # used for extensions (e.g., SysML, C++ coder)
-            pass
-        elif xtype == 'uml:Class':
-            print "+++ mdreader: not handling class yet"
-        else:
+        init = self.init_by_type.get(xtype, None)
+        if not init:
             print "*** mdreader.PackagedElement: unknown 'xmi:type':", xtype
             sys.exit(1)
+        init(self, parent, tag, attrs)
+        self.begx = self.beg_by_type.get(xtype, PackagedElement.begEltInOther)
+        self.endx = self.end_by_type.get(xtype, XmiElement.endEltIn)
         if self.val: parent.val.packagedElement.append(self.val)
 
     def begEltIn(self, tag, attrs):
         # In here we may see almost any element.
-        el = None
-        if self.type == 'uml:Package':
-            return self.begEltInPackage(tag, attrs)
-        elif self.type == 'uml:StateMachine':
-            return self.begEltInStateMachine(tag, attrs)
-        elif self.type == 'uml:Signal':
-            raise Exception
-        elif self.type == 'uml:FunctionBehavior':
-            return self.begEltInFunctionBehavior(tag, attrs)
-        elif self.type == 'uml:Enumeration':
-            return self.begEltInEnumeration(tag, attrs)
-        elif self.type == 'uml:SignalEvent':
-            return self.begEltInSignalEvent(tag, attrs)
-        elif self.type == 'uml:TimeEvent':
-            return self.begEltInTimeEvent(tag, attrs)
-        elif self.type == 'uml:Class':
-            return self.begEltInClass(tag, attrs)
-        elif self.type == 'uml:Profile':
-            return None
-        else:
-            print "in PackagedElement, type=", self.type, ", unknown tag:", tag
-        return el
+        return self.begx(self, tag, attrs)
 
     def endEltIn(self, tag):
-        if self.type == 'uml:Package':
-            return self.endEltInPackage(tag)
-        # skip Enumeration
-        # skip Signal
-        if self.type == 'uml:SignalEvent':
-            return self.endEltInSignalEvent(tag)
-        if self.type == 'uml:StateMachine':
-            return self.endEltInStateMachine(tag)
-        if self.type == 'uml:TimeEvent':
-            return self.endEltInTimeEvent(tag)
-        return XmiElement.endEltIn(self, tag)
+        return self.endx(self, tag)
 
-    def deref(self):
-        val = self.val
-        if self.type == 'uml:StateMachine':
-            self.derefStateMachine()
-        if self.type == 'uml:SignalEvent':
-            self.derefSignalEvent()
-        self.deref_kids()
+    def begEltInOther(self, tag, attrs):
+        print "in PackagedElement, type=", self.type, ", unknown tag:", tag
+        return None
+
+    def initOther(self, parent, tag, attrs):
+        pass
 
     # Package =============================
     def initPackage(self, parent, tag, attrs):
@@ -844,7 +1087,7 @@ class PackagedElement(XmiElement):      # :PackageableElement
     def begEltInPackage(self, tag, attrs):
         el = None
         if tag == 'packagedElement':
-            el = PackagedElement(self, tag, attrs)
+            el = packaged_element(self, tag, attrs)
         elif tag == 'xmi:Extension':
             # \todo just skip for now
             el = SkipElement(self, tag, attrs)
@@ -859,7 +1102,7 @@ class PackagedElement(XmiElement):      # :PackageableElement
 
     # Class ===============================
     def initClass(self, parent, tag, attrs):
-        pass
+        print "+++ mdreader: not handling class yet"
 
     def begEltInClass(self, tag, attrs):
         el = None
@@ -892,13 +1135,13 @@ class PackagedElement(XmiElement):      # :PackageableElement
     def begEltInFunctionBehavior(self, tag, attrs):
         el = None
         if tag == 'body':
-            self.data = ""
+            self.data = []
         return el
 
     def endEltInFunctionBehavior(self, tag, attrs):
         el = None
         if tag == 'body':
-            self.val.body = self.data
+            self.val.body = self.get_data()
         return el
 
     # Signal ==============================
@@ -907,11 +1150,15 @@ class PackagedElement(XmiElement):      # :PackageableElement
         self.val = uml2.Signal()
         self.val.name = attrs.get('name', '(mdreader BUG)')
 
+    def begEltInSignal(self, tag, attrs):
+        raise Exception
+
     # SignalEvent =========================
     def initSignalEvent(self, parent, tag, attrs):
         self.val = uml2.SignalEvent()
         parent.val.packagedElement.append(self.val)
-        self.signal = signal = attrs.get('signal', None)
+        signal = attrs.get('signal', None)
+        if signal: self.ref(self.val, 'signal', signal, ref_sel)
         self.val.name = name = attrs.get('name', None)
         # This belongs in the validator:
         if name and not signal:
@@ -925,11 +1172,6 @@ class PackagedElement(XmiElement):      # :PackageableElement
     def endEltInSignalEvent(self, tag):
         return XmiElement.endEltIn(self, tag)
 
-    def derefSignalEvent(self):
-        if self.signal:
-            self.val.signal = self.xmidict[self.signal]
-        #self.deref_kids() - handled in self.deref()
-
     # StateMachine ========================
     def initStateMachine(self, parent, tag, attrs):
         self.val = uml2.StateMachine()
@@ -952,13 +1194,15 @@ class PackagedElement(XmiElement):      # :PackageableElement
             # <submachineState xmi:idref='...'/>
             # This seems to be used in statemachines to identify that the
             # statemachine is used as a submachine state.
+            # States using this machine may be in machines not loaded.
             if not attrs.has_key('xmi:idref'): raise Exception
-            self.val.submachineState.append(attrs['xmi:idref'])
+            self.ref(self.val.submachineState, 'submachineState',
+                     attrs['xmi:idref'], ref_opt)
         elif tag == 'nestedClassifier':
             if attrs['xmi:type'] != 'uml:Signal': raise Exception
             v = uml2.Signal()
             v.name = attrs['name']
-            self.xmidict[attrs['xmi:id']] = v
+            self.session.xmidict[attrs['xmi:id']] = v
             self.val.nestedClassifier.append(v) # so GAG how do I find this?
         elif tag == 'region':
             el = Region(self, tag, attrs)
@@ -971,7 +1215,7 @@ class PackagedElement(XmiElement):      # :PackageableElement
             v.kind = attrs['kind']
             v.stateMachine = self.val
             v.state = None
-            self.xmidict[attrs['xmi:id']] = v
+            self.session.xmidict[attrs['xmi:id']] = v
             self.val.connectionPoint.append(v)
         elif tag == 'ownedComment':
             el = SkipElement(self, tag, attrs)
@@ -982,15 +1226,6 @@ class PackagedElement(XmiElement):      # :PackageableElement
     def endEltInStateMachine(self, tag):
         return XmiElement.endEltIn(self, tag)
 
-    def derefStateMachine(self):
-        xmidict = self.xmidict
-        idlist = self.val.submachineState
-        smlist = []
-        for idref in idlist:
-            smlist.append(xmidict[idref])
-        self.val.submachineState = smlist
-        #self.deref_kids() - handled in self.deref()
-
     # TimeEvent ===========================
     def initTimeEvent(self, parent, tag, attrs):
         self.val = uml2.TimeEvent()
@@ -1005,6 +1240,74 @@ class PackagedElement(XmiElement):      # :PackageableElement
     def endEltInTimeEvent(self, tag):
         return XmiElement.endEltIn(self, tag)
 
+    # dispatch tables, keyed by xmi:type ==
+    init_by_type = {
+        'uml:Package': initPackage,
+        'uml:StateMachine': initStateMachine,
+        'uml:Signal': initSignal,
+        'uml:FunctionBehavior': initFunctionBehavior,
+        'uml:Enumeration': initEnumeration,
+        'uml:SignalEvent': initSignalEvent,
+        'uml:TimeEvent': initTimeEvent,
+        'uml:LiteralBoolean': initOther,
+        'uml:Profile': initOther,       # used for extensions (e.g., SysML)
+        'uml:Class': initClass,
+        }
+    beg_by_type = {
+        'uml:Package': begEltInPackage,
+        'uml:StateMachine': begEltInStateMachine,
+        'uml:Signal': begEltInSignal,
+        'uml:FunctionBehavior': begEltInFunctionBehavior,
+        'uml:Enumeration': begEltInEnumeration,
+        'uml:SignalEvent': begEltInSignalEvent,
+        'uml:TimeEvent': begEltInTimeEvent,
+        'uml:Class': begEltInClass,
+        'uml:Profile': LtWtHdlr.begEltIn.im_func,
+        }
+    end_by_type = {
+        'uml:Package': endEltInPackage,
+        'uml:SignalEvent': endEltInSignalEvent,
+        'uml:StateMachine': endEltInStateMachine,
+        'uml:TimeEvent': endEltInTimeEvent,
+        }
+
+
+# Selective loading: with a MachineSelection on the root handler only the
+# named state machines are read; other machines and elements a machine
+# can't reference are skipped (cheaply, see ExpatDocumentHandler).
+# Signals, events and behaviors are read and later pruned by prune_model.
+# Submachines live in other machines: their ids come up missing in resolve,
+# and read_model parses again with those machines added to the selection.
+# Any element whose id is selected that way is read, whatever its type.
+
+class MachineSelection:
+
+    # read as in a full load: a Class is parsed (to None) so refs to it
+    # resolve the same way either way
+    skip_types = ('uml:Enumeration', 'uml:Profile', 'uml:LiteralBoolean')
+
+    def __init__(self, names):
+        self.names = set(names)         # machines wanted, by name
+        self.ids = set()                # machines wanted, by xmi:id
+        self.missing = set()            # idrefs not found in resolve
+
+    def keep(self, attrs):
+        "Return True if packagedElement w/ attrs should be read."
+        xtype = attrs['xmi:type']
+        if attrs.get('xmi:id', None) in self.ids: return True
+        if xtype == 'uml:StateMachine':
+            return attrs.get('name', None) in self.names
+        return xtype not in self.skip_types
+
+def packaged_element(parent, tag, attrs):
+    session = parent.session
+    select = session.select
+    if select and not select.keep(attrs):
+        if attrs.has_key('xmi:id'):
+            session.skipped.add(session.xmidict.intern(attrs['xmi:id']))
+        return SkipElement(parent, tag, attrs)
+    return PackagedElement(parent, tag, attrs)
+
 
 class Model(XmiElement):                # :Model
     """
@@ -1022,7 +1325,7 @@ class Model(XmiElement):                # :Model
         if tag == 'ownedMember':
             el = OwnedMember(self, tag, attrs)
         elif tag == 'packagedElement': # MD17, replaces ownedMember from MD10
-            el = PackagedElement(self, tag, attrs)
+            el = packaged_element(self, tag, attrs)
         return el
 
 
@@ -1050,7 +1353,7 @@ class oldProperties(XmiElement):
     def begEltIn(self, tag, attrs):
         el = None
         if tag == 'mdElement':
-            el = Element(self, tag, attrs)
+            el = MdElement(self, tag, attrs)
             self.props.append(el)
         return el
 
@@ -1072,83 +1375,65 @@ class MdElement(XmiElement): # check if this survives to 17.0.2
         XmiElement.__init__(self, parent, tag, attrs)
         self.eclass = str(attrs['elementClass'])
         eclass = self.eclass
-        if eclass == 'Diagram':
-            self.val = mdext.Diagram()
-        elif eclass == 'DiagramFrame':
-            self.val = mdext.DiagramFrame()
-        elif eclass == 'DiagramPresentationElement':
-            self.val = mdext.DiagramPresentationElement()
-        elif eclass == 'PseudoState':
-            self.val = mdext.PseudoState()
-        elif eclass == 'Region':
-            self.val = mdext.Region()
-        elif eclass == 'Split':
-            self.val = mdext.Split()
-        elif eclass == 'State':
-            self.val = mdext.State()
-        elif eclass == 'Transition':
-            self.val = mdext.Transition()
-        elif eclass == 'TextBox':
-            self.val = mdext.TextBox()
-        elif eclass == 'Split':
-            self.val = mdext.Split()
+        klass = self.class_by_eclass.get(eclass, None)
+        if klass:
+            self.val = klass()
         else:
             print '*** mdreader: unknown mdElement class:', eclass
+        self.begx = self.beg_by_eclass.get(eclass, MdElement.begEltInOther)
         # self .ref , .link1, .link2, .linkN
 
     def begEltIn(self, tag, attrs):
-        el = None
-        eclass = self.eclass
-        # handle generic tags
-        if tag == 'elementID':
-            self.val.elementID = attrs['xmi:idref']
-        elif tag == 'geometry':
-            self.data = ""
-        elif tag == 'compartment':
-            pass
-        elif tag == 'mdOwnedViews':
-            el = OwnedViews(self, tag, attrs)
-            self.val.ownedViews = el.val
-        elif tag == 'type':
-            self.data = ''
-            if attrs.has_key('xmi:value'): 
-                self.val.type = attrs['xmi:value']
-        elif tag == 'text':
-            self.data = ''
-        elif tag == 'diagramWindowBounds':
-            self.data = ''
-        # class-specific stuff
-        elif eclass == 'Diagram':
-            el = self.begEltInDiagram(tag, attrs)
-        elif eclass == 'DiagramPresentationElement':
-            el = self.begEltInDiagramPresentationElement(tag, attrs)
-        elif eclass == 'Region':
-            el = self.begEltInRegion(tag, attrs)
-        elif eclass == 'Split':
-            el = self.begEltInSplit(tag, attrs)
-        elif eclass == 'State':
-            el = self.begEltInState(tag, attrs)
-        elif eclass == 'Transition':
-            el = self.begEltInTransition(tag, attrs)
-        else:
-            print '*** mdreader.mdElement: unhandled tag:', tag, \
-                '\n                             or class:', eclass
-        return el
+        # handle generic tags, then class-specific stuff
+        begx = self.beg_by_tag.get(tag, None)
+        if begx:
+            return begx(self, tag, attrs)
+        return self.begx(self, tag, attrs)
 
     def endEltIn(self, tag):
-        if tag == 'geometry':
-            self.val.geometry = parse_geometry(self.data)
-        elif tag == 'type':
-            if not self.val.type: self.val.type = self.data
-        elif tag == 'text':
-            self.val.text = self.data
+        endx = self.end_by_tag.get(tag, None)
+        if endx: endx(self)
         return LtWtHdlr.endEltIn(self, tag)
 
+    # generic tags ====================
+    def begElementID(self, tag, attrs):
+        self.ref(self.val, 'elementID', attrs['xmi:idref'])
+
+    def begText(self, tag, attrs):
+        self.data = []
+
+    def begType(self, tag, attrs):
+        self.data = []
+        if attrs.has_key('xmi:value'): 
+            self.val.type = attrs['xmi:value']
+
+    def begIgnore(self, tag, attrs):
+        return None
+
+    def begOwnedViews(self, tag, attrs):
+        el = MdOwnedViews(self, tag, attrs)
+        self.val.ownedViews = el.val
+        return el
+
+    def endGeometry(self):
+        self.val.geometry = parse_geometry(self.get_data())
+
+    def endType(self):
+        if not self.val.type: self.val.type = self.get_data()
+
+    def endText(self):
+        self.val.text = self.get_data()
+
+    def begEltInOther(self, tag, attrs):
+        print '*** mdreader.mdElement: unhandled tag:', tag, \
+            '\n                             or class:', self.eclass
+        return None
+
     # Diagram =========================
     def begEltInDiagram(self, tag, attrs):
         el = None
         if tag == 'mdElement':
-            el = Element(self, tag, attrs)
+            el = MdElement(self, tag, attrs)
         else:
             print '*** mdreader: unhandled tag in Diagram:', tag
         return el
@@ -1157,7 +1442,7 @@ class MdElement(XmiElement): # check if this survives to 17.0.2
     def begEltInDiagramPresentationElement(self, tag, attrs):
         el = None
         if tag == 'mdElement':
-            el = Element(self, tag, attrs)
+            el = MdElement(self, tag, attrs)
         else:
             #print '*** mdreader: unhandled tag in DiagramPresElt:', tag
             el = SkipElement(self, tag, attrs)
@@ -1167,10 +1452,10 @@ class MdElement(XmiElement): # check if this survives to 17.0.2
     def begEltInRegion(self, tag, attrs):
         el = None
         if tag == 'mdOwnedViews':
-            el = OwnedViews(self, tag, attrs)
+            el = MdOwnedViews(self, tag, attrs)
             self.val.ownedViews = el.val
         elif tag == 'mdElement':
-            el = Element(self, tag, attrs)
+            el = MdElement(self, tag, attrs)
         else:
             print '*** mdreader: unknown tag in begEltInRegion:', tag
             el = SkipElement(self, tag, attrs)
@@ -1197,7 +1482,7 @@ class MdElement(XmiElement): # check if this survives to 17.0.2
             # hack: just skip
             pass
         elif tag == 'mdElement':
-            el = Element(self, tag, attrs)
+            el = MdElement(self, tag, attrs)
         else:
             print '*** mdreader: unknown tag in begEltInRegion:', tag
             el = SkipElement(self, tag, attrs)
@@ -1219,7 +1504,7 @@ class MdElement(XmiElement): # check if this survives to 17.0.2
         elif tag == 'nameVisible':
             pass
         elif tag == 'ownedViews':
-            el = OwnedViews(self, tag, attrs)
+            el = MdOwnedViews(self, tag, attrs)
             self.val.ownedViews = el.val
         elif tag == 'properties':
             el = SkipElement(self, tag, attrs)
@@ -1229,11 +1514,40 @@ class MdElement(XmiElement): # check if this survives to 17.0.2
             el = SkipElement(self, tag, attrs)
         return el
 
-    def deref(self):
-        xmidict = self.xmidict
-        if self.val.elementID:
-            self.val.elementID = xmidict[self.val.elementID]
-        self.deref_kids()
+    # dispatch tables, keyed by elementClass and by tag
+    class_by_eclass = {
+        'Diagram': mdext.Diagram,
+        'DiagramFrame': mdext.DiagramFrame,
+        'DiagramPresentationElement': mdext.DiagramPresentationElement,
+        'PseudoState': mdext.PseudoState,
+        'Region': mdext.Region,
+        'Split': mdext.Split,
+        'State': mdext.State,
+        'Transition': mdext.Transition,
+        'TextBox': mdext.TextBox,
+        }
+    beg_by_eclass = {
+        'Diagram': begEltInDiagram,
+        'DiagramPresentationElement': begEltInDiagramPresentationElement,
+        'Region': begEltInRegion,
+        'Split': begEltInSplit,
+        'State': begEltInState,
+        'Transition': begEltInTransition,
+        }
+    beg_by_tag = {
+        'elementID': begElementID,
+        'geometry': begText,
+        'compartment': begIgnore,
+        'mdOwnedViews': begOwnedViews,
+        'type': begType,
+        'text': begText,
+        'diagramWindowBounds': begText,
+        }
+    end_by_tag = {
+        'geometry': endGeometry,
+        'type': endType,
+        'text': endText,
+        }
 
 
 class oldElementContainer(XmiElement):
@@ -1245,14 +1559,10 @@ class oldElementContainer(XmiElement):
     def begEltIn(self, tag, attrs):
         el = None
         if tag == 'mdElement':
-            el = Element(self, tag, attrs)
+            el = MdElement(self, tag, attrs)
             self.elts.append(el)
         return el
 
-    def deref(self):                    # hack to get around xmielement ...
-        # self.deref_kids()?
-        pass
-
 class MdOwnedViews(XmiElement):
 
     def __init__(self, parent, tag, attrs):
@@ -1269,16 +1579,13 @@ class MdOwnedViews(XmiElement):
 
 # 17.0.2: states, transitions and pseudostates
 
-uzob = []
-uzel = []
-
 class MdUsedObjects(XmiElement):
 
     def __init__(self, parent, tag, attrs):
         XmiElement.__init__(self, parent, tag, attrs)
         id = attrs['href'][1:]
         #print '--- usedObjects:', attrs['href'][1:]
-        uzob.append(id)
+        self.session.uzob.append(id)
 
 class MdDiagramContents(XmiElement):
 
@@ -1292,14 +1599,16 @@ class MdDiagramContents(XmiElement):
         elif tag == 'usedObjects':
             el = MdUsedObjects(self, tag, attrs)
         elif tag == 'usedElements':
-            self.data = ''
+            self.data = []
         return el
 
     def endEltIn(self, tag):
         if tag == 'usedElements':
-            id = self.data
+            id = self.get_data()
             #print '--- usedElements:', id
-            uzel.append(id)
+            self.session.uzel.append(id)
+            # check for UML elements not in diagram: states, transitions
+            self.ref(None, 'used_el', id, ref_mark)
         if tag == self.tag:
             return self.parent
         else:
@@ -1366,16 +1675,6 @@ class MdModelExtension(XmiElement):
             el = SkipElement(self, tag, attrs)
         return el
 
-    def deref(self):
-        xmidict = self.xmidict
-        self.deref_kids()
-        # check for UML elements not in diagram: states, transitions
-        for i in uzel:
-            val = xmidict[i]
-            if val != None:
-                #pdb.set_trace()
-                val.used_el = True
-
 # ========================================
 
 #add_extension(MdOwnedDiagrams)
@@ -1403,9 +1702,15 @@ class MagicdrawExtension(XmiElement):
 
 class MagicdrawFileHdlr(XmiElement):
     # base handler, referenced from mdmain.py 
+    # Handlers for closed elements are dropped unless keep_tree is given:
+    # once refs are registered (see XmiElement.ref) nothing needs them,
+    # so only the uml2 tree and the pending refs grow with the document.
   
-    def __init__(self):
+    def __init__(self, select=None, keep_tree=False, session=None):
         XmiElement.__init__(self, None, "", {})
+        if session: self.session = session
+        else: self.session.select = select
+        self.keep_tree = keep_tree
         self.model = None
         self.extns = []
         self.warn = False
@@ -1484,6 +1789,7 @@ class MagicdrawFileHdlr(XmiElement):
             
     def pu_Region(self, region):
         "Patch up Region."
+        # outgoing and incoming are uml2.TransitionLists: "in" is O(1)
         if region.statemachine == None and region.state == None:
             print "*** region needs to be in state or statemachine"
         if region.statemachine != None and region.state != None:
@@ -1515,5 +1821,113 @@ class MagicdrawFileHdlr(XmiElement):
                         pdb.set_trace()
                         print " ???"
 
+
+# --- reading files ----------------------------------------------------------
+
+import zipfile
+
+md_mf_name = 'com.nomagic.magicdraw.uml_model.model' # file w/ model
+
+def is_mdzip(filename):
+    return re.match(r'.*\.(md)?zip$', filename)
+
+def open_model(filename):
+    """
+    Return a file object for the model XML.  For .mdzip files this is a
+    stream out of the archive: MagicDraw 17.0.2 on uses the member
+    com.nomagic.magicdraw.uml_model.model, 17.0.1 and prior have a single
+    member.  The member is decompressed as it is read.
+    """
+    if not is_mdzip(filename):
+        return open(filename, 'rb')
+    za = zipfile.ZipFile(filename)
+    nl = za.namelist()
+    if md_mf_name in nl:
+        f1 = za.open(md_mf_name)
+    elif len(nl) == 1:
+        f1 = za.open(nl[0])
+    else:
+        za.close()
+        raise Exception, "could not find model file in zip archive: %s" % nl
+    za.close()                          # member stream has its own handle
+    return f1
+
+def parse_model(filename, sax=False, verbose=False, select=None):
+    mdh = MagicdrawFileHdlr(select)
+    f1 = open_model(filename)
+    try:
+        if sax:
+            xml.sax.parse(f1, XmiDocumentHandler(mdh))
+        else:
+            h = ExpatDocumentHandler(mdh)
+            h.parseFile(f1)
+            if verbose: msgI(h.skip_report())
+    finally:
+        f1.close()
+    return mdh
+
+def read_model(filename, sax=False, verbose=False, machs=None):
+    """
+    Parse the .mdzip, .mdxml or XMI file and return the MagicdrawFileHdlr
+    (after patchup), which has the model and extensions.  The XML is
+    streamed through the parser in chunks, never read in whole.  With
+    verbose, report how much of the document was skipped.
+    If machs, a list of StateMachine names, is given only those machines
+    (and their submachines, signals and events) are loaded.
+    """
+    if machs == None:
+        mdh = parse_model(filename, sax, verbose)
+        mdh.patchup()
+        return mdh
+    select = MachineSelection(machs)
+    while True:
+        mdh = parse_model(filename, sax, verbose, select)
+        if not select.missing: break
+        new = select.missing - select.ids
+        if not new:
+            raise Exception, "unresolved idrefs: %s" % list(select.missing)
+        if verbose: msgI("reloading for %d missing idrefs" % len(new))
+        select.ids |= new
+        select.missing = set()
+    mdh.patchup()
+    prune_model(mdh.model)
+    return mdh
+
+def prune_model(model):
+    """
+    Remove signals, events and behaviors not referenced from the state
+    machines in the model.
+    """
+    used = set()
+    def inR(region):
+        for vtx in region.subvertex:
+            for reg in getattr(vtx, 'region', []):
+                inR(reg)
+        for trn in region.transition:
+            for trg in trn.trigger:
+                evt = trg.event
+                used.add(evt)
+                used.add(getattr(evt, 'signal', None))
+            used.add(trn.guard)
+            used.add(trn.effect)
+    def inP(pkg):
+        for elt in pkg.packagedElement:
+            if isinstance(elt, uml2.StateMachine):
+                for reg in elt.region: inR(reg)
+            elif isinstance(elt, uml2.Package):
+                inP(elt)
+    def pruneP(pkg):
+        keep = []
+        for elt in pkg.packagedElement:
+            if isinstance(elt, prune_types) and elt not in used:
+                continue
+            if isinstance(elt, uml2.Package): pruneP(elt)
+            keep.append(elt)
+        pkg.packagedElement = keep
+    inP(model)
+    pruneP(model)
+
+prune_types = (uml2.Signal, uml2.Event, uml2.OpaqueBehavior)
+
 # --- last line of ssk/mdreader.py ---
 
@@ -0,0 +1,295 @@
+# mdsynth.py - generate synthetic MagicDraw (MD17) models for benchmarks
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# The generated file looks like what MagicDraw 17.0.2 writes: an Events
+# package with Signals and SignalEvents, a set of StateMachines with
+# nested (composite) states, triggers, guards and effects, a diagram
+# extension per machine and a top-level extension with stuff the reader
+# skips.  The structure is regular so it scales: nmach machines with
+# nstate states each, every nsub-th state composite.  With nsubm > 0 every
+# nsubm-th top-level state is a submachine state referencing a shared
+# machine "Fault" (with an entry and an exit point).  The transition into
+# such a state goes through its entry point and one more leaves from its
+# exit point.
+
+import zipfile
+
+md_mf_name = 'com.nomagic.magicdraw.uml_model.model'
+
+xmi_head = """<?xml version='1.0' encoding='UTF-8'?>
+<xmi:XMI xmi:version='2.1' xmlns:uml='http://www.omg.org/spec/UML/20090901' xmlns:xmi='http://schema.omg.org/spec/XMI/2.1' xmlns:MagicDraw_Profile='http://www.omg.org/spec/UML/20090901/MagicDraw_Profile' xmlns:c___ANSI_profile='http://www.magicdraw.com/schemas/c___ANSI_profile.xmi'>
+ <xmi:Documentation>
+  <xmi:exporter>MagicDraw UML</xmi:exporter>
+  <xmi:exporterVersion>17.0.2</xmi:exporterVersion>
+ </xmi:Documentation>
+"""
+
+xmi_tail = "</xmi:XMI>\n"
+
+class ModelWriter:
+    """
+    Writer for synthetic model.  Call write(f1) to generate the XMI text.
+    """
+
+    def __init__(self, nmach=10, nstate=20, nsig=16, nsub=5, ndiag=20,
+                 nsubm=0):
+        self.nmach = nmach              # number of state machines
+        self.nstate = nstate            # number of states per machine
+        self.nsig = nsig                # number of signals
+        self.nsub = nsub                # every nsub-th state is composite
+        self.ndiag = ndiag              # diagram elements per machine
+        self.nsubm = nsubm              # every nsubm-th state is submachine
+        self.seq = 0
+        self.sigevt = []                # list of SignalEvent xmi:id's
+        self.used = []                  # xmi:id's used in current diagram
+        self.fault = None               # (id, entry id, exit id) of Fault
+        self.fault_users = []           # submachine states using Fault
+
+    def newid(self):
+        self.seq += 1
+        return '_17_0_2_%x_%d' % (self.seq*7919 % 65521, self.seq)
+
+    def write(self, f1):
+        f1.write(xmi_head)
+        f1.write(" <uml:Model xmi:id='%s' name='Data' visibility='public'>\n"
+                 % (self.newid(),))
+        self.w_events(f1)
+        if self.nsubm > 0:
+            self.fault = (self.newid(), self.newid(), self.newid())
+        for i in range(self.nmach):
+            self.w_machine(f1, 'Mach%d' % (i,))
+        if self.fault:
+            self.w_fault(f1)
+        f1.write(" </uml:Model>\n")
+        self.w_extension(f1)
+        f1.write(xmi_tail)
+
+    def w_events(self, f1):
+        f1.write("  <packagedElement xmi:type='uml:Package' xmi:id='%s'"
+                 " name='Events' visibility='public'>\n" % (self.newid(),))
+        for i in range(self.nsig):
+            sid = self.newid(); eid = self.newid()
+            f1.write("   <packagedElement xmi:type='uml:Signal' xmi:id='%s'"
+                     " name='ev%d' visibility='public'/>\n" % (sid, i))
+            f1.write("   <packagedElement xmi:type='uml:SignalEvent'"
+                     " xmi:id='%s' visibility='public' signal='%s'/>\n"
+                     % (eid, sid))
+            self.sigevt.append(eid)
+        f1.write("  </packagedElement>\n")
+
+    def w_machine(self, f1, name):
+        mid = self.newid()
+        self.used = []
+        f1.write("  <packagedElement xmi:type='uml:StateMachine'"
+                 " xmi:id='%s' name='%s' visibility='public'>\n" % (mid, name))
+        self.w_region(f1, name, self.nstate, 3, 0)
+        self.w_diagram(f1, mid, name)
+        f1.write("  </packagedElement>\n")
+
+    def w_fault(self, f1):
+        mid, enid, exid = self.fault
+        b = ' '*3
+        self.used = []
+        f1.write("  <packagedElement xmi:type='uml:StateMachine'"
+                 " xmi:id='%s' name='Fault' visibility='public'>\n" % (mid,))
+        self.w_region(f1, 'Fault', 3, 3, 2, (enid, exid))
+        f1.write(b+"<connectionPoint xmi:type='uml:Pseudostate' xmi:id='%s'"
+                 " name='fin' visibility='public' kind='entryPoint'/>\n"
+                 % (enid,))
+        f1.write(b+"<connectionPoint xmi:type='uml:Pseudostate' xmi:id='%s'"
+                 " name='fout' visibility='public' kind='exitPoint'/>\n"
+                 % (exid,))
+        for sid in self.fault_users:
+            f1.write(b+"<submachineState xmi:idref='%s'/>\n" % (sid,))
+        f1.write("  </packagedElement>\n")
+
+    def w_region(self, f1, name, nstate, ind, depth, cpts=None):
+        b = ' '*ind
+        f1.write(b+"<region xmi:type='uml:Region' xmi:id='%s'"
+                 " visibility='public'>\n" % (self.newid(),))
+        pid = self.newid()
+        f1.write(b+" <subvertex xmi:type='uml:Pseudostate' xmi:id='%s'"
+                 " visibility='public'/>\n" % (pid,))
+        sids = []
+        conns = {}                      # index -> (entry, exit) connection
+        for i in range(nstate):
+            sid = self.newid()
+            sids.append(sid)
+            self.used.append(sid)
+            if self.fault and depth == 0 and i % self.nsubm == self.nsubm-1 \
+                    and not (self.nsub > 0 and i % self.nsub == self.nsub-1):
+                conns[i] = self.w_substate(f1, b+' ', sid, '%s_S%d' % (name, i))
+                continue
+            f1.write(b+" <subvertex xmi:type='uml:State' xmi:id='%s'"
+                     " name='%s_S%d' visibility='public'>\n" % (sid, name, i))
+            f1.write(b+"  <entry xmi:type='uml:FunctionBehavior' xmi:id='%s'"
+                     " name='en_%s_S%d' visibility='public'/>\n"
+                     % (self.newid(), name, i))
+            if depth < 2 and self.nsub > 0 and i % self.nsub == self.nsub-1:
+                self.w_region(f1, '%s_S%d' % (name, i), 3, ind+2, depth+1)
+            f1.write(b+" </subvertex>\n")
+        f1.write(b+" <transition xmi:type='uml:Transition' xmi:id='%s'"
+                 " visibility='public' source='%s' target='%s'/>\n"
+                 % (self.newid(), pid, sids[0]))
+        nsig = len(self.sigevt)
+        for i in range(nstate):
+            tid = self.newid()
+            self.used.append(tid)
+            src = sids[i]; dst = sids[(i+1) % nstate]
+            if conns.has_key((i+1) % nstate):
+                dst = conns[(i+1) % nstate][0]
+            evt = self.sigevt[(i + depth) % nsig]
+            if i % 3 == 1:
+                cid = self.newid()
+                f1.write(b+" <transition xmi:type='uml:Transition'"
+                         " xmi:id='%s' visibility='public' source='%s'"
+                         " target='%s' guard='%s'>\n" % (tid, src, dst, cid))
+                f1.write(b+"  <ownedRule xmi:type='uml:Constraint'"
+                         " xmi:id='%s' visibility='public'>\n" % (cid,))
+                f1.write(b+"   <specification xmi:type='uml:OpaqueExpression'"
+                         " xmi:id='%s' visibility='public'>\n" % (self.newid(),))
+                f1.write(b+"    <body>x%d &gt; %d</body>\n" % (i, depth))
+                f1.write(b+"    <language>C</language>\n")
+                f1.write(b+"   </specification>\n")
+                f1.write(b+"  </ownedRule>\n")
+            else:
+                f1.write(b+" <transition xmi:type='uml:Transition'"
+                         " xmi:id='%s' visibility='public' source='%s'"
+                         " target='%s'>\n" % (tid, src, dst))
+            f1.write(b+"  <trigger xmi:type='uml:Trigger' xmi:id='%s'"
+                     " visibility='public' event='%s'/>\n" % (self.newid(), evt))
+            if i % 2 == 0:
+                f1.write(b+"  <effect xmi:type='uml:OpaqueBehavior'"
+                         " xmi:id='%s' name='act%d' visibility='public'>\n"
+                         % (self.newid(), i))
+                f1.write(b+"   <body>do_act%d();</body>\n" % (i,))
+                f1.write(b+"  </effect>\n")
+            f1.write(b+" </transition>\n")
+        for i in sorted(conns.keys()):
+            f1.write(b+" <transition xmi:type='uml:Transition' xmi:id='%s'"
+                     " visibility='public' source='%s' target='%s'/>\n"
+                     % (self.newid(), conns[i][1], sids[(i+2) % nstate]))
+        if cpts:
+            f1.write(b+" <transition xmi:type='uml:Transition' xmi:id='%s'"
+                     " visibility='public' source='%s' target='%s'/>\n"
+                     % (self.newid(), cpts[0], sids[1 % nstate]))
+            f1.write(b+" <transition xmi:type='uml:Transition' xmi:id='%s'"
+                     " visibility='public' source='%s' target='%s'>\n"
+                     % (self.newid(), sids[-1], cpts[1]))
+            f1.write(b+"  <trigger xmi:type='uml:Trigger' xmi:id='%s'"
+                     " visibility='public' event='%s'/>\n"
+                     % (self.newid(), self.sigevt[-1]))
+            f1.write(b+" </transition>\n")
+        f1.write(b+"</region>\n")
+
+    def w_substate(self, f1, b, sid, name):
+        mid, enid, exid = self.fault
+        self.fault_users.append(sid)
+        cids = (self.newid(), self.newid())
+        f1.write(b+"<subvertex xmi:type='uml:State' xmi:id='%s' name='%s'"
+                 " visibility='public' submachine='%s'>\n" % (sid, name, mid))
+        f1.write(b+" <connection xmi:type='uml:ConnectionPointReference'"
+                 " xmi:id='%s' visibility='public'>\n" % (cids[0],))
+        f1.write(b+"  <entry xmi:idref='%s'/>\n" % (enid,))
+        f1.write(b+" </connection>\n")
+        f1.write(b+" <connection xmi:type='uml:ConnectionPointReference'"
+                 " xmi:id='%s' visibility='public'>\n" % (cids[1],))
+        f1.write(b+"  <exit xmi:idref='%s'/>\n" % (exid,))
+        f1.write(b+" </connection>\n")
+        f1.write(b+"</subvertex>\n")
+        return cids
+
+    def w_diagram(self, f1, mid, name):
+        b = ' '*3
+        f1.write(b+"<xmi:Extension extender='MagicDraw UML 17.0.2'>\n")
+        f1.write(b+" <modelExtension>\n")
+        f1.write(b+"  <ownedDiagram xmi:type='uml:Diagram' xmi:id='%s'"
+                 " name='%s' visibility='public' context='%s'"
+                 " ownerOfDiagram='%s'>\n" % (self.newid(), name, mid, mid))
+        f1.write(b+"   <xmi:Extension extender='MagicDraw UML 17.0.2'>\n")
+        f1.write(b+"    <diagramRepresentation>\n")
+        f1.write(b+"     <diagram:DiagramRepresentationObject ID='%s'"
+                 " type='State Machine Diagram' xmi:version='2.0'"
+                 " xmlns:diagram='http://www.nomagic.com/ns/magicdraw/"
+                 "core/diagram/1.0'>\n" % (self.newid(),))
+        f1.write(b+"      <diagramContents contentHash='%x'"
+                 " exporterName='MagicDraw UML' exporterVersion='17.0.2'>\n"
+                 % (hash(name) & 0xffffffff,))
+        f1.write(b+"       <binaryObject streamContentID='BINARY-%s'>\n"
+                 % (self.newid(),))
+        for i in range(self.ndiag):
+            self.w_mdelt(f1, b+'        ', i)
+        f1.write(b+"       </binaryObject>\n")
+        for id in self.used:
+            f1.write(b+"       <usedObjects href='#%s'/>\n" % (id,))
+        for id in self.used:
+            f1.write(b+"       <usedElements>%s</usedElements>\n" % (id,))
+        f1.write(b+"      </diagramContents>\n")
+        f1.write(b+"     </diagram:DiagramRepresentationObject>\n")
+        f1.write(b+"    </diagramRepresentation>\n")
+        f1.write(b+"   </xmi:Extension>\n")
+        f1.write(b+"  </ownedDiagram>\n")
+        f1.write(b+" </modelExtension>\n")
+        f1.write(b+"</xmi:Extension>\n")
+
+    def w_mdelt(self, f1, b, i):
+        f1.write(b+"<mdElement elementClass='State' xmi:id='%s'>\n"
+                 % (self.newid(),))
+        f1.write(b+" <elementID xmi:idref='%s'/>\n"
+                 % (self.used[i % len(self.used)],))
+        f1.write(b+" <geometry>%d, %d, 120, 60</geometry>\n" % (40*i, 30*i))
+        f1.write(b+" <compartment compartmentID='TAGGED_VALUES'"
+                 " compartmentVisible='false'/>\n")
+        f1.write(b+" <mdOwnedViews>\n")
+        f1.write(b+"  <mdElement elementClass='TextBox' xmi:id='%s'>\n"
+                 % (self.newid(),))
+        f1.write(b+"   <geometry>%d, %d, 60, 20</geometry>\n" % (40*i, 30*i))
+        f1.write(b+"   <text>state %d</text>\n" % (i,))
+        f1.write(b+"  </mdElement>\n")
+        f1.write(b+" </mdOwnedViews>\n")
+        f1.write(b+"</mdElement>\n")
+
+    def w_extension(self, f1):
+        for i in range(self.nmach):
+            f1.write(" <c___ANSI_profile:C__Namespace xmi:id='%s'"
+                     " base_Namespace='%s'>\n" % (self.newid(), self.newid()))
+            f1.write("  <header>/* generated */</header>\n")
+            f1.write(" </c___ANSI_profile:C__Namespace>\n")
+        f1.write(" <xmi:Extension extender='MagicDraw UML 17.0.2'>\n")
+        f1.write("  <proxy xmi:id='%s'>\n" % (self.newid(),))
+        for i in range(self.nmach * self.ndiag):
+            f1.write("   <element href='#%s' xmi:id='%s'/>\n"
+                     % (self.newid(), self.newid()))
+        f1.write("  </proxy>\n")
+        f1.write(" </xmi:Extension>\n")
+
+
+def write_model(filename, **kwargs):
+    "Write a synthetic model to an .mdxml or (if name ends w/ zip) .mdzip file."
+    if filename.endswith('zip'):
+        import StringIO
+        buf = StringIO.StringIO()
+        ModelWriter(**kwargs).write(buf)
+        za = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+        za.writestr(md_mf_name, buf.getvalue())
+        za.close()
+    else:
+        f1 = open(filename, 'w')
+        ModelWriter(**kwargs).write(f1)
+        f1.close()
+
+# --- last line of mdsynth.py ---
@@ -40,8 +40,20 @@ class StateChart:
         self.maxid = 0                  # max id used
         self.nslot = 0                  # number of slots for sc-state
         self.idmap = []                 # vector of states by (leaf) id
+        self.cindex = None              # ChartIndex, see chart_index()
+        self.tindex = None              # TransitionIndex, see trans_index()
+        self.sindex = None              # ScopeIndex, see scope_index()
 
-class State:
+# State, Region and Transition have __slots__: charts can have 10^5
+# states and more.  Empty lists of children and actions are the shared
+# empty tuple until something is added (add_region, add_state, or by
+# assigning a new list).  Code here only reads them.
+
+class State(object):
+
+    __slots__ = ('parent', 'level', 'name', 'fullname', 'region', 'index',
+                 'id', 'nslot', 'offset', 'mark', 'a_en', 'a_do', 'a_ex',
+                 'otrans', 'itrans', 'ltrans')
  
     def __init__(self, parent = None):
         self.parent = parent		# parent region, None if root
@@ -50,25 +62,34 @@ class State:
         else:
             self.level = 0
         self.name = None		# name for state
-        self.region = []		# children, if empty, state is simple
+        self.fullname = None            # dotted path name (uml2ssk)
+        self.region = ()		# children, if empty, state is simple
         self.index = None               # index in parent, starts at 0
         self.id = -1                    # unique ID in statechart scope
         self.nslot = 0                  # num slots to store in parent region
         self.offset = -1                # offset in parent region ??
         self.mark = None		# is marked state ('final', 'progress')
-        self.a_en = []                  # string[*]: on-entry actions
-        self.a_do = []                  # string[*]: during actions(tivities)
-        self.a_ex = []                  # string[*]: exit actions
-        self.otrans = []                # Transition: outgoing
-        self.itrans = []                # Transition: incoming
-        self.ltrans = []                # ???: loop transitions (internal)
+        self.a_en = ()                  # string[*]: on-entry actions
+        self.a_do = ()                  # string[*]: during actions(tivities)
+        self.a_ex = ()                  # string[*]: exit actions
+        self.otrans = ()                # Transition: outgoing
+        self.itrans = ()                # Transition: incoming
+        self.ltrans = ()                # ???: loop transitions (internal)
+
+    def add_region(self, region):
+        if self.region: self.region.append(region)
+        else: self.region = [region]
+
+class Region(object):
 
-class Region:
+    __slots__ = ('parent', 'name', 'fullname', 'state', 'initial', 'index',
+                 'nslot', 'offset', 'dhist', 'shist')
 
     def __init__(self, parent = None):
         self.parent = parent		# parent state
         self.name = None
-        self.state = []			# children, does not include ?hist
+        self.fullname = None            # dotted path name (uml2ssk)
+        self.state = ()			# children, does not include ?hist
         self.initial = 0                # index of initial state
         self.index = None               # index in parent container
         #self.id = -1                    # unique ID in statechart scope
@@ -80,7 +101,14 @@ class Region:
         # out of region must be save state.  So C impl must include struct
         # with saved states
 
-class Transition:
+    def add_state(self, state):
+        if self.state: self.state.append(state)
+        else: self.state = [state]
+
+class Transition(object):
+
+    __slots__ = ('type', 'id', 'source', 'target', 'label', 'guard',
+                 'actions')
 
     def __init__(self, type = 'external'):
         self.type = type                # ???
@@ -89,126 +117,464 @@ class Transition:
         self.target = None		# State: target
         self.label = None		# string: event label
         self.guard = None		# string: guard expression
-        self.actions = []		# string: action list
+        self.actions = ()		# string: action list
+
+
+class IdAllocator:
+    """
+    Allocator for state IDs.  IDs taken are kept in a set, so checks are
+    O(1) and the lowest free ID is found by moving a mark up.  With
+    prev, a dict of state fullname -> ID from an earlier run (see
+    read_state_ids), states claim their old IDs first so that adding or
+    removing a state doesn't renumber the others.
+    """
+
+    def __init__(self, prev=None):
+        self.used = set()               # IDs taken
+        self.low = 1                    # no free ID below this
+        self.maxid = 0                  # max ID taken
+        self.prev = prev or {}          # fullname -> ID from earlier run
+        self.claimed = {}               # fullname -> ID reserved for it
+
+    def reserve(self, id):
+        self.used.add(id)
+        if id > self.maxid: self.maxid = id
+
+    def is_used(self, id):
+        return id in self.used
+
+    def claim(self, name):
+        "Reserve the earlier ID of name, if any, for alloc(name)."
+        id = self.prev.get(name, None)
+        if id == None or id in self.used: return
+        self.reserve(id)
+        self.claimed[name] = id
+
+    def alloc(self, name=None):
+        "Return ID for name: the one claimed for it, else the lowest free."
+        if self.claimed.has_key(name):
+            return self.claimed.pop(name)
+        while self.low in self.used:
+            self.low = self.low + 1
+        id = self.low
+        self.reserve(id)
+        return id
+
+def read_state_ids(path):
+    "Return dict state fullname -> ID from path, empty if none there."
+    prev = {}
+    try:
+        f1 = open(path)
+    except IOError:
+        return prev
+    for line in f1:
+        if line.startswith('#'): continue
+        name, id = line.rstrip('\n').split('\t')
+        prev[name] = int(id)
+    f1.close()
+    return prev
+
+def write_state_ids(path, mach):
+    "Write state fullname -> ID of indexed mach to path."
+    f1 = open(path, 'w')
+    f1.write("# state IDs of %s: fullname <tab> ID\n" % (mach.name,))
+    for s in mach.idmap:
+        if s == None: continue
+        f1.write("%s\t%d\n" % (s.fullname, s.id))
+    f1.close()
+
+class ChartIndex:
+    """
+    Flat index of a StateChart.  States and regions are numbered in
+    pre-order (the root state is 0) and the tree is kept in arrays:
+      state[n]   State             region[r]  Region
+      parent[n]  parent state      rstate[r]  state of region
+      preg[n]    parent region     rfirst[r]  first state in region
+      level[n]                     rnext[r]   next region of rstate[r]
+      leaf[n]    simple state?     initial[r] initial state
+      first[n]   first region      roffset[r], rnslot[r]
+      next[n]    next state in preg[n]
+      offset[n], nslot[n]
+    (-1 for none).  offset and nslot are filled by the passes below,
+    which loop over the arrays; num maps State to n.  The numbers are
+    not the state IDs, which come from IdAllocator: id[n], byid[id].
+    """
+
+    def __init__(self, mach):
+        self.state = state = []; self.parent = parent = []
+        self.preg = preg = []; self.level = level = []
+        self.leaf = leaf = []; self.first = first = []; self.next = nxt = []
+        self.region = region = []; self.rstate = rstate = []
+        self.rfirst = rfirst = []; self.rnext = rnext = []
+        self.num = num = {}
+        rlast = []                      # last state in region so far
+        slast = {}                      # last region of state so far
+        stack = [(mach.root, -1, -1)]   # (State, parent, preg) or
+        while stack:                    # (Region, rstate, None)
+            obj, p, pr = stack.pop()
+            if pr == None:
+                r = len(region)
+                region.append(obj)
+                rstate.append(p)
+                rfirst.append(-1)
+                rnext.append(-1)
+                rlast.append(-1)
+                if p in slast: rnext[slast[p]] = r
+                else: first[p] = r
+                slast[p] = r
+                for st in reversed(obj.state):
+                    stack.append((st, p, r))
+                continue
+            n = len(state)
+            state.append(obj)
+            parent.append(p)
+            preg.append(pr)
+            level.append(obj.level)
+            leaf.append(not obj.region)
+            first.append(-1)
+            nxt.append(-1)
+            num[obj] = n
+            if pr >= 0:
+                if rlast[pr] >= 0: nxt[rlast[pr]] = n
+                else: rfirst[pr] = n
+                rlast[pr] = n
+            for reg in reversed(obj.region):
+                stack.append((reg, n, None))
+        self.initial = len(region)*[-1]
+        for r in range(len(self.region)):
+            reg = self.region[r]
+            if 0 <= reg.initial < len(reg.state):
+                self.initial[r] = self.num[reg.state[reg.initial]]
+        ns = len(self.state)
+        self.offset = ns*[-1]
+        self.nslot = ns*[0]
+        self.roffset = len(self.region)*[-1]
+        self.rnslot = len(self.region)*[0]
+        self.id = [st.id for st in self.state]
+        self.byid = []
+
+    def regions(self, n):
+        "Return list of regions of state n."
+        res = []
+        r = self.first[n]
+        while r >= 0:
+            res.append(r)
+            r = self.rnext[r]
+        return res
+
+    def substates(self, r):
+        "Return list of states in region r."
+        res = []
+        n = self.rfirst[r]
+        while n >= 0:
+            res.append(n)
+            n = self.next[n]
+        return res
+
+    def leaves(self):
+        "Return list of simple states, in order."
+        return [n for n in range(len(self.state)) if self.leaf[n]]
+
+    def subregions(self, n):
+        "Return list of regions below state n, in order."
+        res = []
+        stack = list(reversed(self.regions(n)))
+        while stack:
+            r = stack.pop()
+            res.append(r)
+            for n1 in reversed(self.substates(r)):
+                stack.extend(reversed(self.regions(n1)))
+        return res
+
+def chart_index(mach):
+    "Return ChartIndex of mach, made on first use (and by index_ssk)."
+    if mach.cindex == None:
+        mach.cindex = ChartIndex(mach)
+    return mach.cindex
+
+class TransitionIndex:
+    """
+    Transitions of a StateChart by source state and label, made once
+    from mach.trans (after index_ssk, which numbers and sorts them):
+      own[(id, label)]   transitions from state id itself
+      lookup(id, label)  transitions enabled in state id: its own, then
+                         those of the enclosing composites, innermost
+                         first (UML priority); alternatives with guards
+                         are kept, in mach.trans order
+      enabled(id)        dict label => lookup(id, label)
+      ordered(id)        all transitions enabled in state id, innermost
+                         source first
+      bylabel[label]     all transitions with label
+    label is None for completion transitions.  Results are tuples: they
+    are shared between a state and its substates.
+    """
 
+    def __init__(self, mach):
+        ci = chart_index(mach)
+        own = {}
+        bylabel = {}
+        for t in mach.trans:
+            own.setdefault((t.source.id, t.label), []).append(t)
+            bylabel.setdefault(t.label, []).append(t)
+        for key in own.keys():
+            own[key] = tuple(own[key])
+        for key in bylabel.keys():
+            bylabel[key] = tuple(bylabel[key])
+        labels = {}                     # state id => label => own trans
+        for (id, label), ts in own.items():
+            labels.setdefault(id, {})[label] = ts
+        fromid = {}                     # state id => own trans
+        for t in mach.trans:
+            fromid.setdefault(t.source.id, []).append(t)
+        # Parents come first in ChartIndex order.  A state w/o its own
+        # transitions shares the dict of its parent.
+        table = len(ci.state)*[None]
+        for n in range(len(ci.state)):
+            p = ci.parent[n]
+            if p < 0: enabled = {}
+            else: enabled = table[p]
+            mine = labels.get(ci.id[n])
+            if mine:
+                enabled = dict(enabled)
+                for label, ts in mine.items():
+                    enabled[label] = ts + enabled.get(label, ())
+            table[n] = enabled
+        self.cindex = ci
+        self.own = own
+        self.bylabel = bylabel
+        self.table = table
+        self.fromid = fromid
+        self.memo = {}                  # for ordered()
+
+    def enabled(self, id):
+        return self.table[self.cindex.byid[id]]
+
+    def lookup(self, id, label):
+        return self.table[self.cindex.byid[id]].get(label, ())
+
+    def ordered(self, id):
+        memo = self.memo
+        if memo.has_key(id): return memo[id]
+        ci = self.cindex
+        path = []                       # up to a state done already
+        n = ci.byid[id]
+        while n >= 0 and not memo.has_key(ci.id[n]):
+            path.append(n)
+            n = ci.parent[n]
+        if n < 0: done = ()
+        else: done = memo[ci.id[n]]
+        for n in reversed(path):
+            done = tuple(self.fromid.get(ci.id[n], ())) + done
+            memo[ci.id[n]] = done
+        return done
+
+    def labels(self):
+        return sorted(self.bylabel.keys())
+
+def trans_index(mach):
+    "Return TransitionIndex of mach, made on first use (and by index_ssk)."
+    if mach.tindex == None:
+        mach.tindex = TransitionIndex(mach)
+    return mach.tindex
+
+class ScopeIndex:
+    """
+    Least common ancestors in a StateChart, by binary lifting over the
+    ChartIndex: up[k][n] is the 2^k-th ancestor of state number n.
+      lca(n1, n2)        state number of the LCA of n1 and n2
+      region(st1, st2)   deepest Region holding st1 and st2 (or their
+                         ancestors); None if one of them is the root
+      trans(src, dst)    (region, exits, entries) for a transition from
+                         src to dst: exits are the states left, src up,
+                         entries the states entered, down to dst.  Kept
+                         per (src, dst) so backends can share them.
+    As in UML2 the LCA can be a state if src and dst are in different
+    regions of an orthogonal state; region() then gives its region.
+    """
+
+    def __init__(self, mach):
+        ci = chart_index(mach)
+        ns = len(ci.state)
+        depth = ns*[0]
+        for n in range(1, ns):          # parents come first
+            depth[n] = depth[ci.parent[n]] + 1
+        up = [ci.parent]
+        k = 1
+        while (1 << k) <= max(depth + [0]):
+            prev = up[-1]
+            up.append([prev[p] if p >= 0 else -1 for p in prev])
+            k = k + 1
+        self.cindex = ci
+        self.depth = depth
+        self.up = up
+        self.memo = {}
+
+    def lift(self, n, d):
+        "Return ancestor of state number n d levels up."
+        k = 0
+        while d:
+            if d & 1: n = self.up[k][n]
+            d = d >> 1
+            k = k + 1
+        return n
+
+    def below(self, n1, n2):
+        """
+        Return (a1, a2): ancestors (or selves) of n1 and n2 at the same
+        level, just below their LCA, or equal if one is above the other.
+        """
+        d1 = self.depth[n1]; d2 = self.depth[n2]
+        if d1 > d2: n1 = self.lift(n1, d1 - d2)
+        elif d2 > d1: n2 = self.lift(n2, d2 - d1)
+        if n1 == n2: return n1, n2
+        for k in range(len(self.up)-1, -1, -1):
+            u = self.up[k]
+            if u[n1] != u[n2]:
+                n1 = u[n1]; n2 = u[n2]
+        return n1, n2
+
+    def lca(self, n1, n2):
+        a1, a2 = self.below(n1, n2)
+        if a1 == a2: return a1
+        return self.cindex.parent[a1]
+
+    def region_num(self, n1, n2):
+        ci = self.cindex
+        a1, a2 = self.below(n1, n2)
+        if a1 != a2 and ci.preg[a1] != ci.preg[a2]:
+            a1 = ci.parent[a1]          # different orthogonal regions
+        return ci.preg[a1]
+
+    def region(self, st1, st2):
+        ci = self.cindex
+        r = self.region_num(ci.num[st1], ci.num[st2])
+        if r < 0: return None
+        return ci.region[r]
+
+    def trans(self, src, dst):
+        key = (src, dst)
+        if self.memo.has_key(key): return self.memo[key]
+        ci = self.cindex
+        r = self.region_num(ci.num[src], ci.num[dst])
+        exits = []
+        n = ci.num[src]
+        while ci.preg[n] != r:
+            exits.append(ci.state[n])
+            n = ci.parent[n]
+        exits.append(ci.state[n])
+        entries = []
+        n = ci.num[dst]
+        while ci.preg[n] != r:
+            entries.append(ci.state[n])
+            n = ci.parent[n]
+        entries.append(ci.state[n])
+        entries.reverse()
+        if r < 0: res = (None, tuple(exits), tuple(entries))
+        else: res = (ci.region[r], tuple(exits), tuple(entries))
+        self.memo[key] = res
+        return res
+
+def scope_index(mach):
+    "Return ScopeIndex of mach, made on first use (and by index_ssk)."
+    if mach.sindex == None:
+        mach.sindex = ScopeIndex(mach)
+    return mach.sindex
 
 def used_ids(mach):
     "Return list of used (e.g., reserved) IDs."
-    def inR(r, l):
-        for s in r.state:
-            inS(s, l)
-    def inS(s, l):
-        if len(s.region) == 0:
-            if s.id > 0: l.append(s.id)
-            return l
-        for r in s.region:
-           inR(r, l)
-        return l
-    ids = inS(mach.root, [])
+    ci = chart_index(mach)
+    ids = [st.id for st in ci.state if len(st.region) == 0 and st.id > 0]
     for id in ids:
         if id > 255:
             print "*** ssk1: reserved ID > 255!  NO NO NO"
     return ids
 
-def assign_leaf_ids(mach, reserved=[]):
-    "Assign IDs, leaves first, and return max id."
-    def inR(r, mx):
-        for s in r.state:
-            mx = inS(s, mx)
-        return mx
-    def inS(s, mx):
-        if len(s.region) == 0:
-            while True:
-                mx = mx + 1
-                if mx not in reserved: break
-            s.id = mx
-            return mx
-        for r in s.region:
-            mx = inR(r, mx)
-        return mx
-    return inS(mach.root, 0)
-
-def assign_node_ids(mach, reserved=[]):
-    "Assign IDs, leaves first, and return max id."
-    def inR(r, mx, res):
-        for s in r.state:
-            mx = inS(s, mx, res)
-        return mx
-    def inS(s, mx, res):
-        if len(s.region) == 0:
-            return mx
-        while True:
-            mx = mx + 1
-            if mx not in res: break
-        s.id = mx
-        for r in s.region:
-            mx = inR(r, mx, res)
-        return mx
-    mach.maxid = inS(mach.root, 0, reserved)
+def assign_leaf_ids(mach, ids):
+    "Assign IDs to leaves (w/o one) from IdAllocator ids; return max id."
+    ci = chart_index(mach)
+    for n in range(len(ci.state)):
+        st = ci.state[n]
+        if ci.leaf[n] and st.id <= 0:
+            st.id = ids.alloc(st.fullname)
+        ci.id[n] = st.id
+    return ids.maxid
+
+def assign_node_ids(mach, ids):
+    "Assign IDs to composite states, after assign_leaf_ids."
+    ci = chart_index(mach)
+    for n in range(len(ci.state)):
+        st = ci.state[n]
+        if not ci.leaf[n] and st.id <= 0:
+            st.id = ids.alloc(st.fullname)
+        ci.id[n] = st.id
+    mach.maxid = ids.maxid
     return
 
 def gen_idmap(mach):
     "Set up map of id to state."
-    def inR(m, r):
-        for s in r.state:
-            inS(m, s)
-    def inS(m, s):
-        m.idmap[s.id] = s
-        for r in s.region:
-            inR(m, r)
+    ci = chart_index(mach)
     mach.idmap = (mach.maxid+1)*[None]
-    inS(mach, mach.root)
+    ci.byid = (mach.maxid+1)*[-1]
+    for n in range(len(ci.state)):
+        st = ci.state[n]
+        mach.idmap[st.id] = st
+        ci.byid[st.id] = n
 
 def assign_nslots(mach):
-    def inR(r):
-        nslot = 0
-        for s in r.state:
-            ns = inS(s)
-            if ns > nslot: nslot = ns
-        r.nslot = nslot
-        return nslot
-    def inS(s):
-        if len(s.region) == 0:
-            s.nslot = 1
-            return 1
-        nslot = 0
-        for r in s.region:
-            nslot += inR(r)
-        s.nslot = nslot
-        return nslot
-    mach.nslot = inS(mach.root)
+    ci = chart_index(mach)
+    nslot = ci.nslot
+    rnslot = ci.rnslot
+    # children are numbered after their parents
+    for n in range(len(ci.state)-1, -1, -1):
+        if ci.leaf[n]:
+            nslot[n] = 1
+        else:
+            ns = 0
+            for r in ci.regions(n):
+                rns = 0
+                for n1 in ci.substates(r):
+                    if nslot[n1] > rns: rns = nslot[n1]
+                rnslot[r] = rns
+                ci.region[r].nslot = rns
+                ns += rns
+            nslot[n] = ns
+        ci.state[n].nslot = nslot[n]
+    mach.nslot = nslot[0]
     return
     
 def assign_offsets(mach):
-    def inR(r, offset):
-        r.offset = offset
-        for s in r.state:
-            inS(s, offset)
-        return offset + r.nslot
-    def inS(s, offset):
-        s.offset = offset
-        for r in s.region:
-            offset = inR(r, offset)
-    inS(mach.root, 0)
+    ci = chart_index(mach)
+    ci.offset[0] = 0
+    ci.state[0].offset = 0
+    for n in range(len(ci.state)):
+        offset = ci.offset[n]
+        for r in ci.regions(n):
+            ci.roffset[r] = offset
+            ci.region[r].offset = offset
+            for n1 in ci.substates(r):
+                ci.offset[n1] = offset
+                ci.state[n1].offset = offset
+            offset = offset + ci.rnslot[r]
 
 def expand_nslots(mach):
     """
     Expand nslot for last region of each state to fill out max for
     the parent state.
     """
-    def inR(r):
-        for s in r.state:
-            s.nslot = r.nslot
-            inS(s)
-    def inS(s):
+    ci = chart_index(mach)
+    for n in range(len(ci.state)):
+        rs = ci.regions(n)
+        if not rs: continue
         nslot = 0
-        for r in s.region:
-            nslot += r.nslot
-            if r == s.region[-1]:
-                if s.nslot > nslot:
-                    r.nslot += s.nslot - nslot
-            inR(r)
-    inS(mach.root)
+        for r in rs:
+            nslot += ci.rnslot[r]
+        if ci.nslot[n] > nslot:
+            ci.rnslot[rs[-1]] += ci.nslot[n] - nslot
+            ci.region[rs[-1]].nslot = ci.rnslot[rs[-1]]
+        for r in rs:
+            for n1 in ci.substates(r):
+                ci.nslot[n1] = ci.rnslot[r]
+                ci.state[n1].nslot = ci.rnslot[r]
     return
 
 def cmp_tr(a, b):
@@ -223,15 +589,27 @@ def cmp_tr(a, b):
     else:
         return 0
 
-def index_ssk(ss):
+def claim_ids(mach, ids):
+    "Claim earlier IDs (see IdAllocator) for all states."
+    for st in chart_index(mach).state:
+        ids.claim(st.fullname)
+
+def index_ssk(ss, prev=None):
+    # prev: state fullname -> ID from an earlier run, to keep IDs stable
     print "add depth to SSK regions/states"
-    rez = used_ids(ss)
-    #print "used_ids => ", rez
-    mx = assign_leaf_ids(ss, rez)
-    rez.extend(range(1,mx+1))
-    mx = assign_node_ids(ss, rez)
+    ss.cindex = ChartIndex(ss)
+    ids = IdAllocator(prev)
+    for id in used_ids(ss):
+        ids.reserve(id)
+    claim_ids(ss, ids)
+    assign_leaf_ids(ss, ids)
+    assign_node_ids(ss, ids)
+    if ss.maxid > 255:
+        print "*** ssk1: state ID > 255"
     gen_idmap(ss)
     ss.trans.sort(cmp_tr)
+    ss.tindex = TransitionIndex(ss)
+    ss.sindex = ScopeIndex(ss)
     #
     assign_nslots(ss)
     assign_offsets(ss)
@@ -258,22 +636,21 @@ def elab_state(mach, state):
     """
     Elaborate state.
     """
-    def inR(region, ste):
-        inS(region.state[region.initial], ste)
-    def inS(state, ste):
-        if len(state.region) == 0:
-            inreg = state.parent
-            st = inreg.offset
-            ns = inreg.nslot
-            nd = st + ns
-            ste[st:nd] = ns*[0]
-            ste[st] = state.id
-        else:
-            for r in state.region:
-                inR(r, ste)
-    #
+    ci = chart_index(mach)
     stenc = mach.nslot*[None]
-    inS(state, stenc)
+    stack = [ci.num[state]]
+    while stack:
+        n = stack.pop()
+        if ci.leaf[n]:
+            r = ci.preg[n]
+            st = ci.roffset[r]
+            ns = ci.rnslot[r]
+            stenc[st:st+ns] = ns*[0]
+            stenc[st] = ci.id[n]
+        else:
+            # regions in order, each entered at its initial state
+            for r in reversed(ci.regions(n)):
+                stack.append(ci.initial[r])
     return tuple(stenc)
 
 def merge_encsts(est0, ests):
@@ -316,18 +693,14 @@ def merge_pstate(est0, pstate):
     return tuple(est1)
 
 def find_transitions(mach, label):
-    #
-    pass
+    "Return transitions of mach with label, in mach.trans order."
+    return trans_index(mach).bylabel.get(label, ())
 
 def mach_labels(mach):
     """
     Find all labels used in a machine.
     """
-    used = set()
-    for t in mach.trans:
-        if t.label:
-            used.add(t.label)
-    return list(used)
+    return [l for l in trans_index(mach).bylabel.keys() if l]
 
 def state_depth(mach, encst):
     """
@@ -343,6 +716,7 @@ def state_depth(mach, encst):
         st = mach.idmap[encst[ix]]
         if st.level > depth:
             depth = st.level
+        ix += 1
     return depth
 
 def raise_depth(mach, est0):
@@ -365,81 +739,27 @@ def raise_depth(mach, est0):
             at_depth = [ix]
         elif st.level == depth:
             at_depth.append(ix)
+        ix += 1
     return depth
 
-def buildit(mach):
-    init = elab_state(mach, mach.root)
-    pp(0, "init=%s", init)
-    nslot = mach.nslot
-    labels = mach_labels(mach)
-
-    # generate transitions from init
-    esl = []
-    trl = []
-    est = tuple(map(lambda e: e or 0, init))
-    next = [est]
-    while True:
-        if len(next) == 0: break
-        esl.extend(next)
-        prev = next; next = []
-        #pp(0, "prev=%s", prev)
-        for es in prev:
-            ix = 0
-            es0 = es
-            for label in labels:
-                # I think this will work best if we iterate over labels.
-                # Then start at es and iterate through levels via raise_depth
-                # until returned est[0] == mach.root.id.
-                while es0[0] != mach.root.id:
-
-                    # list of transitions from source in es
-                    tl = filter(lambda t: \
-                                t.source.id in es0 and t.label == label,
-                                mach.trans)
-
-                    # collect comb's of encoded targets
-                    if len(tl) > 0:
-                        pp(2, "multiple transitions:")
-                        for t in tl:
-                            pp(2, "t [%s %s %s]", tr.source.id, label, \
-                               tr.target.id)
-                    else:
-                        pp(2, "t [%s %s %s]", tr.source.id, label, tr.target.id)
-
-                    # Following part needs work.
-                    et = merge_states(mach, es, [tr.target])
-                    trl.append([es, tr, et])
-                    #pp(4, "merge: %s =%s=> %s", es, tr.label, et)
-                    if not et in esl and et not in next:
-                        next.append(et)
-
-                # Now propagate each state in es to parent.
-                # \todo Do we need to do all combinations here?  
-                while ix < nslot:
-                    # \todo Fix this hack: idmap[0] should be root
-                    #       Should root.id always be 0? (not currently)
-                    if es0[ix] == 0:
-                        ix = ix + 1
-                        continue
-                    #
-                    s = mach.idmap[es0[ix]]
-                    if s.parent.parent != mach.root:
-                        es0 = merge_pstate(es0, s.parent.parent)
-                        break
-                    else:
-                        ix = ix + 1
-                if ix == nslot:
-                    break
-    print "esl:", esl
-    #print "trl:", trl
-    # Generate dict
+def buildit(mach, maxconf=None):
+    """
+    Explore the reachable (encoded) states, breadth first from the
+    initial state; see explore.py.  Return esl, list of encoded states,
+    esd, dict encoded state => index in esl, and trl, list of [i, tr, j]
+    for each transition tr taken from esl[i] to esl[j].
+    """
+    from explore import Explorer
+    ex = Explorer(mach, maxconf)
+    ex.run(True)
+    esl = [ex.unpack(key) for key in ex.configs]
     esd = {}
-    nes = len(esl)
-    for i in range(nes):
+    for i in range(len(esl)):
         esd[esl[i]] = i
-    #print "esd:", esd
-    trl = map(lambda t: [esd[t[0]], t[1], esd[t[2]]], trl)
-    print trl
+    trl = []
+    for i, step, j in ex.edges():
+        for tr in step:
+            trl.append([i, tr, j])
     return esl, esd, trl
 
     
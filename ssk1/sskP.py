@@ -34,16 +34,30 @@ class SskWriter:
         self.write_trailer()
 
     def write_state(self, state, il=0):
-        self.w_state(state, il)
-        for region in state.region:
-            self.write_region(region, il+1)
-        self.w_end_state(state, il)
+        self.write_tree('S', state, il)
 
     def write_region(self, region, il=0):
-        self.w_region(region, il)
-        for state in region.state:
-            self.write_state(state, il+1)
-        self.w_end_region(region, il)
+        self.write_tree('R', region, il)
+
+    def write_tree(self, kind, top, il=0):
+        # w/ a stack, not recursion: charts can be nested deep
+        stack = [(kind, top, il)]
+        while stack:
+            kind, obj, il = stack.pop()
+            if kind == 'S':
+                self.w_state(obj, il)
+                stack.append(('/S', obj, il))
+                for region in reversed(obj.region):
+                    stack.append(('R', region, il+1))
+            elif kind == 'R':
+                self.w_region(obj, il)
+                stack.append(('/R', obj, il))
+                for state in reversed(obj.state):
+                    stack.append(('S', state, il+1))
+            elif kind == '/S':
+                self.w_end_state(obj, il)
+            else:
+                self.w_end_region(obj, il)
 
     def write_header(self, il=0):
         self.w_header(il)
@@ -88,9 +102,9 @@ class SskTextWriter(SskWriter):
         f1.write(s+ '  .name: %s\n' % (state.name,))
         f1.write(s+ '  .id: %d\n' % (state.id,))
         f1.write(s+ '  .index: %d\n' % (state.index,))
-        f1.write(s+ '  .a_en: %s\n' % (str(state.a_en),))
-        f1.write(s+ '  .a_ex: %s\n' % (str(state.a_ex),))
-        f1.write(s+ '  .a_do: %s\n' % (str(state.a_do),))
+        f1.write(s+ '  .a_en: %s\n' % (str(list(state.a_en)),))
+        f1.write(s+ '  .a_ex: %s\n' % (str(list(state.a_ex)),))
+        f1.write(s+ '  .a_do: %s\n' % (str(list(state.a_do)),))
 
     def w_region(self, region, il=0):
         f1 = self.f1
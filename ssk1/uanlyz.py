@@ -420,9 +420,14 @@ class ModelAnalyzer:
     # sanity checks
     if state.isOrthogonal and not state.isComposite:
       print " *** a_state: orthogonal but not composite"
-    # process transitions
-    for trans in state.outgoing: pass
-    for trans in state.incoming: pass
+    # process transitions: same trigger on two unguarded transitions
+    # out of a state is non-deterministic
+    for sig in state.outgoing.signals():
+      if sig == None: continue
+      trns = [t for t in state.outgoing.by_signal(sig) if not t.guard]
+      if len(trns) > 1:
+        print " +++ a_state: %s: %d unguarded transitions on %s" % \
+          (state.longname, len(trns), getattr(sig, 'name', sig))
     if state.isComposite:
       if not state.isOrthogonal and len(state.region) > 1: raise Exception
       ix = 1
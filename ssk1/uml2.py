@@ -281,12 +281,80 @@ class Model(Package):
 
 # === StateMachine pacakge =============
 
+class TransitionList(list):
+    """
+    List of transitions for Vertex.outgoing and .incoming, kept as an
+    insertion-ordered set: a set behind the list makes "trn in vtx.outgoing"
+    O(1) and appending a transition already there does nothing.
+    by_signal(sig) gives the transitions triggered by sig (a Signal, or
+    the event for a trigger that is not a SignalEvent, or None for no
+    trigger).  That index is built on first use after a change; call
+    reindex() if triggers are changed afterwards.
+    Only append, extend and remove keep the set; don't use other list
+    mutators.
+    """
+
+    def __init__(self, items=()):
+        list.__init__(self)
+        self.members = set()
+        self.bysig = None
+        self.extend(items)
+
+    def __reduce__(self):
+        return (TransitionList, (list(self),))
+
+    def __contains__(self, trn):
+        return trn in self.members
+
+    def append(self, trn):
+        if trn in self.members: return
+        self.members.add(trn)
+        list.append(self, trn)
+        self.bysig = None
+
+    def extend(self, trns):
+        for trn in trns: self.append(trn)
+
+    def remove(self, trn):
+        list.remove(self, trn)
+        self.members.discard(trn)
+        self.bysig = None
+
+    def reindex(self):
+        bysig = {}
+        for trn in self:
+            for key in trigger_keys(trn):
+                bysig.setdefault(key, []).append(trn)
+        self.bysig = bysig
+
+    def by_signal(self, sig):
+        if self.bysig == None: self.reindex()
+        return self.bysig.get(sig, [])
+
+    def signals(self):
+        "Return keys of by_signal: triggering signals (etc), in order."
+        keys = []
+        for trn in self:
+            for key in trigger_keys(trn):
+                if key not in keys: keys.append(key)
+        return keys
+
+def trigger_keys(trn):
+    "Keys for TransitionList.by_signal: signals (etc) that trigger trn."
+    if not trn.trigger: return [None]
+    keys = []
+    for trg in trn.trigger:
+        evt = trg.event
+        if isinstance(evt, SignalEvent): keys.append(evt.signal)
+        else: keys.append(evt)
+    return keys
+
 class Vertex(NamedElement):
     def __init__(self):
         NamedElement.__init__(self)
         # associations
-        self.outgoing = []		# :Transition[0..*]
-        self.incoming = []		# :Transition[0..*]
+        self.outgoing = TransitionList() # :Transition[0..*]
+        self.incoming = TransitionList() # :Transition[0..*]
         self.container = None		# :Region[0..1]
         # added attributes (see anlyz.py)
         self.level = -1			# :int - level of state in heirarchy
@@ -30,8 +30,16 @@ import uml2
 #    1. a model can contain several state machines and signals
 
 # Todos:
-#    1. we need to expand substatemachines
-#    2. check for normal transition notation (guard etc)
+#    1. check for normal transition notation (guard etc)
+
+# Submachine states:
+#    A StateMachine used by submachine states is translated once per
+#    translator (see sub_template) and each submachine state gets a copy
+#    of the translated regions, renamed under the state.  Entry and exit
+#    points, and connection point references, become junction points:
+#    placeholder ssk1.States outside the tree.  Once all transitions are
+#    in, splice_points joins each transition into a junction with each
+#    transition out of it, so the statechart has only real states.
 
 # for debugging - so we only print warning once
 nskip_Signal = 0
@@ -53,12 +61,86 @@ def msgI(msg):
 ssk_allowed_effects = ( uml2.OpaqueBehavior, uml2.FunctionBehavior)
 allow_activity = True
 
+# Containers followed by UMLIndex for the xmi:id map.
+index_attrs = ('packagedElement', 'nestedPackage', 'region', 'subvertex',
+               'transition', 'connectionPoint', 'connection', 'trigger')
+
+class UMLIndex:
+    """
+    Index of a UML model, built once and shared by translators:
+      stms    : simple name -> list of StateMachines, in model order
+      qstms   : qualified name (Pkg::Sub::Mach, below the Model) -> machine
+      signals : name -> Signal
+      byid    : xmi:id -> element (Packages and machine contents), filled
+                on the first find_id
+      subcache: StateMachine -> (stc, points), submachines translated so
+                far (see UMLtranslator.sub_template)
+    Usage:
+      index = UMLIndex(model)
+      ssl = UMLtranslator(index).translate_many(['Mach1', 'Pkg::Mach2'])
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.stms = {}
+        self.qstms = {}
+        self.signals = {}
+        self.byid = None
+        self.subcache = {}
+        self.add_pkg(model, '')
+
+    def add_pkg(self, pkg, prefix):
+        # Same order as the old find_stm_in_pkg search, so the first
+        # machine of a name is the one it would have found.
+        for elt in pkg.packagedElement:
+            eclass = elt.__class__
+            if eclass == uml2.StateMachine:
+                self.stms.setdefault(elt.name, []).append(elt)
+                self.qstms.setdefault(prefix + (elt.name or ''), elt)
+            elif eclass == uml2.Signal:
+                self.signals.setdefault(elt.name, elt)
+            elif eclass == uml2.Package:
+                self.add_pkg(elt, prefix + (elt.name or '') + '::')
+        for p in pkg.nestedPackage:
+            self.add_pkg(p, prefix + (p.name or '') + '::')
+
+    def add_ids(self, model):
+        byid = {}
+        seen = {}
+        stack = [model]
+        while stack:
+            elt = stack.pop()
+            if seen.has_key(id(elt)): continue
+            seen[id(elt)] = True
+            d = elt.__dict__             # getattr w/ default is slow
+            xid = d.get('xmi_id', None)
+            if xid: byid[xid] = elt
+            for attr in index_attrs:
+                if d.has_key(attr): stack.extend(d[attr])
+        self.byid = byid
+
+    def find_id(self, xid):
+        "Return element with xmi:id xid, or None."
+        if self.byid == None: self.add_ids(self.model)
+        return self.byid.get(xid, None)
+
+    def find_stm(self, name):
+        "Return StateMachine for simple or qualified name, or None."
+        if '::' in name:
+            return self.qstms.get(name, None)
+        stms = self.stms.get(name, None)
+        if not stms: return None
+        if len(stms) > 1:
+            msgW("%d machines named %s, using first" % (len(stms), name))
+        return stms[0]
+
 class UMLtranslator:
 
-    def __init__(self):
+    def __init__(self, index=None):
         #self.stc = ssk1.StateChart()    # statechart
         self.model = None
-        self.stmd = {}                  # dict of state machines in UML model
+        self.index = None               # UMLIndex of model
+        if index: self.set_model(index.model, index)
         # for converting state machine
         self.reset()
 
@@ -68,66 +150,125 @@ class UMLtranslator:
         self.rdict = {}                 # uregion -> xregion dictionary
         self.trans = []                 # transitions (first u, then x?)
         self.inits = []                 # initial states
+        self.points = {}                # entry/exit point -> junction
+        self.junctions = []             # junctions from submachine states
 
     # --- user routines ---
-    def set_model(self, u_model):
+    def set_model(self, u_model, index=None):
          # UML/XMI says 1 model per file (but file also has extensions)
         self.model = u_model
-        self.find_all_stms()
+        if index == None or index.model is not u_model:
+            index = UMLIndex(u_model)
+        self.index = index
 
     def find_stm(self, stmname):
-        return self.find_stm_in_pkg(stmname, self.model)
-        #return self.stmd.get(stmname, None)
+        return self.index.find_stm(stmname)
 
     def find_all_stms(self):
-        self.stmd = {}
-        return self.find_stms_in_pkg(self.model)
+        "Return dict of state machines: simple name -> list of machines."
+        return self.index.stms
 
     def translate_stm(self, ustm):
         #self.xl_Model(self.model)
+        self.reset()
         self.xl_StateMachine(ustm)
+        # nothing outside to connect the machine's own points to
+        splice_points(self.stc, self.points.values())
 
-    # --- internal routines ---
-    def find_stm_in_pkg(self, stmname, pkg):
-        for elt in pkg.packagedElement:
-            eclass = elt.__class__
-            if eclass == uml2.StateMachine:
-                if elt.name == stmname: return elt
-            elif eclass == uml2.Package:
-                stm = self.find_stm_in_pkg(stmname, elt)
-                if stm: return stm
-        for p in pkg.nestedPackage:
-            stm = self.find_stm_in_pkg(stmname, p)
-            if stm: return stm
-        return None
-
-    def find_stms_in_pkg(self, pkg):
-        for elt in pkg.packagedElement:
-            if elt.__class__ == uml2.StateMachine:
-                if self.stmd.has_key(elt.name): raise Exception
-                self.stmd[elt.name] = elt
-        for p in pkg.nestedPackage:
-            self.find_stms_in_pkg(p)
+    def translate_many(self, names):
+        """
+        Translate the named machines (simple or qualified names).  Return
+        list of ssk1.StateChart, in the order of names.
+        """
+        stcs = []
+        for name in names:
+            ustm = self.find_stm(name)
+            if ustm == None:
+                msgF("statemachine not found: %s" % (name,))
+                raise Exception, "statemachine not found"
+            self.translate_stm(ustm)
+            stcs.append(self.stc)
+        return stcs
 
-    def infuse_substatemachine(self, ustate):
-        # should be called "expand_substatemachine"
-        # maybe set up a map of connection points to new statemachine entries
-        submach = ustate.submachine
-        print "infuse_ssm: ", submach.name
-        print "st.conn:", ustate.connection
-        print "st.cpts:", ustate.connectionPoint
-        print "st.incm:", ustate.incoming
-        print "st.outg:", ustate.outgoing
-        print ""
+    # --- internal routines ---
+    def infuse_substatemachine(self, ustate, xstate):
+        """
+        Expand submachine state: give xstate a copy of the translated
+        submachine and map the connection point references of ustate.
+        """
         # For each entry:
         # 1. If there is no connection point then entry is to initial state.
-        #    Check to make sure there is a default.
-        # 2. If there is a connection point, then name consistency matters.
+        # 2. If there is a connection point, the transition is joined with
+        #    the one from the entry point in the submachine.
         # For each exit:
-        # 1. If there is no connection point then exit is from final state.
-        #
-        # generate replacement state
-        
+        # 1. If there is no connection point then exit is from xstate.
+        # 2. Else as for entry, w/ the transition to the exit point.
+        submach = ustate.submachine
+        if submach == None:
+            msgF("no submachine for state %s" % (xstate.fullname,))
+            raise Exception
+        tstc, tpoints = self.sub_template(submach)
+        smap = {}
+        copy_regions(tstc.root, xstate, smap)
+        upoints = {}                    # entry/exit point -> junction
+        for upoint, tpoint in tpoints.items():
+            xpoint = new_junction(tpoint.mark, tpoint.name, xstate)
+            smap[tpoint] = xpoint
+            upoints[upoint] = xpoint
+            self.junctions.append(xpoint)
+        for xtrans in tstc.trans:
+            self.stc.trans.append(copy_transition(xtrans, smap))
+        for ucon in ustate.connection:
+            # The reference is a junction too, w/ a plain transition to
+            # each entry point and from each exit point it names.
+            xcon = new_junction('connection', ucon.name, xstate)
+            self.sdict[ucon] = xcon
+            self.junctions.append(xcon)
+            for upoint in ucon.entry:
+                xpoint = self.sub_point(upoints, upoint, xstate, submach)
+                self.add_link(xcon, xpoint)
+            for upoint in ucon.exit:
+                xpoint = self.sub_point(upoints, upoint, xstate, submach)
+                self.add_link(xpoint, xcon)
+
+    def sub_point(self, upoints, upoint, xstate, submach):
+        "Junction for entry/exit point upoint of xstate's submachine."
+        if not upoints.has_key(upoint):
+            msgF("connection of %s to point not in %s" \
+                 % (xstate.fullname, submach.name))
+            raise Exception
+        return upoints[upoint]
+
+    def add_link(self, source, target):
+        xtrans = ssk1.Transition()
+        xtrans.source = source
+        xtrans.target = target
+        self.stc.trans.append(xtrans)
+
+    def sub_template(self, umach):
+        """
+        Return (stc, points) for umach used as submachine: the translated
+        machine and dict of its entry/exit points to junctions.  Each
+        machine is translated once per UMLIndex, so once per model for all
+        translators sharing it; submachine states copy the result.
+        """
+        subcache = self.index.subcache
+        if subcache.has_key(umach):
+            tmpl = subcache[umach]
+            if tmpl == None:
+                msgF("submachine %s contains itself" % (umach.name,))
+                raise Exception
+            return tmpl
+        subcache[umach] = None          # in progress
+        xl = UMLtranslator(self.index)
+        try:
+            xl.xl_StateMachine(umach)
+        except:
+            del subcache[umach]         # others may still try it
+            raise
+        tmpl = (xl.stc, xl.points)
+        subcache[umach] = tmpl
+        return tmpl
 
     def xl_Model(self, umodel):
         # Model is package plus visibility
@@ -174,6 +315,10 @@ class UMLtranslator:
             stc.name = umach.name
             xstate.name = stc.name
             xstate.fullname = xstate.name
+        for upoint in umach.connectionPoint:
+            xpoint = new_junction(upoint.kind, upoint.name, xstate)
+            self.points[upoint] = xpoint
+            self.sdict[upoint] = xpoint
         for uregion in umach.region:
             #print "uregion:", uregion
             self.xl_Region(uregion, xstate)
@@ -181,13 +326,16 @@ class UMLtranslator:
         for utrans in self.trans:
             #print "utrans:", utrans
             self.xl_Transition(utrans)
+        # Own points are kept for use as a submachine (see sub_template).
+        splice_points(stc, self.junctions)
+        self.junctions = []
 
     def xl_Region(self, uregion, xparent):
         " uml.region, ssk.parent"
         xregion = ssk1.Region(xparent)
         init_defined = False
         self.rdict[uregion] = xregion
-        xparent.region.append(xregion)
+        xparent.add_region(xregion)
         xregion.index = len(xparent.region) - 1
         xregion.name = '_' + str(xregion.index)
         xregion.fullname = xparent.fullname + '.' + xregion.name
@@ -224,7 +372,7 @@ class UMLtranslator:
     def xl_Pseudostate(self, upseudo, xparent):
         stc = self.stc
         xstate = ssk1.State(xparent)
-        xparent.state.append(xstate)
+        xparent.add_state(xstate)
         xstate.index = len(xparent.state) - 1
         if upseudo.name != None:
             xstate.name = ustate.name
@@ -248,7 +396,7 @@ class UMLtranslator:
         " uml.state, ssk.parent (region)"
         stc = self.stc
         xstate = ssk1.State(xparent)
-        xparent.state.append(xstate)
+        xparent.add_state(xstate)
         xstate.index = len(xparent.state) - 1
         if ustate.name != None:
             xstate.name = ustate.name
@@ -269,7 +417,7 @@ class UMLtranslator:
             self.xl_Region(ustate.region[0], xstate)
         elif ustate.isSubmachineState:
             #print "substatemachine"
-            self.infuse_substatemachine(ustate)
+            self.infuse_substatemachine(ustate, xstate)
             #raise Exception, "*** uml2ssk: can't handle SubmachineState (yet)"
         else:
             msgF("coding error")
@@ -309,19 +457,20 @@ class UMLtranslator:
             msgF("trans target not found")
             raise Exception
         if isinstance(utrans.target, uml2.Pseudostate):
-            if utrans.target.kind not in ('deepHistory', 'shallowHistory'):
+            if utrans.target.kind not in ('deepHistory', 'shallowHistory',
+                                          'entryPoint', 'exitPoint'):
                 msgF("target is unsupported Pseudostate")
                 raise Exception
-        uregion = utrans.target.container
-        xregion = self.rdict[uregion]
         xtarget = sdict[utrans.target]
         # Find source.
         if not utrans.source:
             msgF("trans has no source")
             raise Exception
-        if isinstance(utrans.source, uml2.Pseudostate):
+        if isinstance(utrans.source, uml2.Pseudostate) and \
+           utrans.source.kind not in ('entryPoint', 'exitPoint'):
             if utrans.source.kind == 'initial':
                 # add this initial state to the region
+                xregion = self.rdict[utrans.target.container]
                 if xregion.initial != 0:
                     msgF("initial state already defined")
                     raise Exception
@@ -404,19 +553,116 @@ class UMLtranslator:
             if action: xtrans.actions = [action]
 
 
+def new_junction(kind, name, xstate):
+    "Return placeholder ssk1.State for a junction point in xstate."
+    xpoint = ssk1.State()
+    xpoint.mark = kind                  # entryPoint, exitPoint, connection
+    xpoint.name = name or '_' + kind
+    xpoint.fullname = xstate.fullname + '.' + xpoint.name
+    return xpoint
+
+def copy_regions(xsrc, xdst, smap):
+    """
+    Give ssk1 state xdst copies of the regions (and all below) of xsrc,
+    full names rebased from xsrc to xdst.  smap gets old -> new states.
+    """
+    n = len(xsrc.fullname)
+    smap[xsrc] = xdst
+    stack = [(xsrc, xdst)]
+    while stack:
+        src, dst = stack.pop()
+        for sreg in src.region:
+            dreg = ssk1.Region(dst)
+            dst.add_region(dreg)
+            dreg.name = sreg.name
+            dreg.fullname = xdst.fullname + sreg.fullname[n:]
+            dreg.index = sreg.index
+            dreg.initial = sreg.initial
+            dreg.dhist = sreg.dhist
+            dreg.shist = sreg.shist
+            for sst in sreg.state:
+                dst1 = ssk1.State(dreg)
+                dreg.add_state(dst1)
+                dst1.name = sst.name
+                dst1.fullname = xdst.fullname + sst.fullname[n:]
+                dst1.index = sst.index
+                dst1.id = sst.id
+                dst1.mark = sst.mark
+                dst1.a_en = sst.a_en[:]
+                dst1.a_do = sst.a_do[:]
+                dst1.a_ex = sst.a_ex[:]
+                smap[sst] = dst1
+                stack.append((sst, dst1))
+
+def copy_transition(xtrans, smap):
+    "Return copy of ssk1 transition w/ states mapped through smap."
+    xcopy = ssk1.Transition(xtrans.type)
+    xcopy.source = smap[xtrans.source]
+    xcopy.target = smap[xtrans.target]
+    xcopy.label = xtrans.label
+    xcopy.guard = xtrans.guard
+    xcopy.actions = xtrans.actions[:]
+    return xcopy
+
+def join_transitions(xin, xout):
+    "Return transition for xin (into a junction) followed by xout."
+    xtrans = ssk1.Transition(xin.type)
+    xtrans.source = xin.source
+    xtrans.target = xout.target
+    if xin.label and xout.label:
+        msgW("triggers on both sides of %s, using %s" \
+             % (xin.target.fullname, xin.label))
+    xtrans.label = xin.label or xout.label
+    if xin.guard and xout.guard:
+        xtrans.guard = "(%s) && (%s)" % (xin.guard, xout.guard)
+    else:
+        xtrans.guard = xin.guard or xout.guard
+    if xin.actions or xout.actions:
+        xtrans.actions = list(xin.actions) + list(xout.actions)
+    return xtrans
+
+def splice_points(stc, points):
+    """
+    Remove junction points from the transitions of stc: each transition
+    into a point is joined with each transition out of it.  Transitions
+    into a point with none out (or out of one with none in) are dropped.
+    """
+    if not points: return
+    pts = set(points)
+    ins = {}
+    outs = {}
+    def add(xtrans):
+        if xtrans.target in pts: ins.setdefault(xtrans.target, []).append(xtrans)
+        if xtrans.source in pts: outs.setdefault(xtrans.source, []).append(xtrans)
+    for xtrans in stc.trans: add(xtrans)
+    for xpoint in points:
+        xins = ins.get(xpoint, [])
+        xouts = outs.get(xpoint, [])
+        if xins and not xouts and xpoint.mark == 'entryPoint':
+            msgW("nothing from entry point %s" % (xpoint.fullname,))
+        for xin in xins:
+            for xout in xouts:
+                if xin is xout: continue
+                xtrans = join_transitions(xin, xout)
+                stc.trans.append(xtrans)
+                add(xtrans)
+    stc.trans = [t for t in stc.trans
+                 if t.source not in pts and t.target not in pts]
+
 
 from impl_c2 import C2Impl
 from impl_pml import PmlImpl
 
-def uml_to_ssk(model, machname):
+def uml_to_ssk(model, machname, index=None):
     # Given UML model, statemach name, and diagram-flag return  (ssk,diag|None).
+    # Pass index (UMLIndex of model) when converting several machines.
     
     xl = UMLtranslator()
-    xl.set_model(model)
+    xl.set_model(model, index)
     ustm = xl.find_stm(machname)
     if ustm == None: 
         print '*** uml_to_ssk: statemachine not found:', machname
-        print xl.stmd.keys()
+        print xl.find_all_stms().keys()
         raise Exception, "statemachine not found"
     #
     xl.translate_stm(ustm)
@@ -0,0 +1,245 @@
+# visited.py - disk-backed visited set for chart exploration
+#
+# Copyright (C) 2018 Matthew R. Wette
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the licence with this software.
+# If not, see <http://www.gnu.org/licenses/>.
+
+# A VisitedTable numbers fixed-width keys (packed configurations, see
+# explore.py) 0, 1, ... in the order they are added.  It is two files:
+#  * <path>.q, the keys end to end in order of their numbers: this is
+#    the BFS queue and what a run is resumed from;
+#  * <path>, a header page, then an open-addressing hash table (linear
+#    probing, CRC-32 of the key) of entries (number + 1, key), 0 empty.
+# The table is kept at most half full; it doubles by being rebuilt from
+# <path>.q.  While it fits in ramsize bytes it is an anonymous mmap; past
+# that it is mapped from <path> and the kernel pages it to disk.
+#
+# checkpoint() syncs <path>.q and writes the header: key count, keys
+# expanded and edges so far.  close() also writes the table and marks the
+# header clean.  Opening with resume=True keeps the first count keys of
+# <path>.q; the table is read back if clean, else rebuilt from the keys.
+
+import os
+import mmap
+import zlib
+import struct
+
+visited_format = 1
+hdr_size = mmap.ALLOCATIONGRANULARITY
+hdr_fmt = '<12sIIQQQQI'                 # + name
+hdr_magic = 'ssk1-visit'
+
+class VisitedTable:
+    """
+    Usage:
+      vt = VisitedTable(path, keylen, ramsize=64<<20)
+      ix, new = vt.add(key)             # number of key; new if just added
+      vt.get(key)                       # number or None
+      vt.key(ix)                        # key numbered ix
+      vt.checkpoint(done, nedge)
+      vt.close(done, nedge)
+      vt = VisitedTable(path, keylen, resume=True)
+      vt.count, vt.done, vt.nedge       # as of the last checkpoint
+    """
+
+    def __init__(self, path, keylen, ramsize=64<<20, resume=False, name=''):
+        self.path = path
+        self.qpath = path + '.q'
+        self.keylen = keylen
+        self.ewidth = 4 + keylen        # bytes per entry
+        self.ramsize = ramsize
+        self.name = name
+        self.count = 0                  # keys
+        self.done = 0                   # as given to checkpoint
+        self.nedge = 0
+        self.capacity = 0               # entries, a power of two
+        self.mm = None
+        self.ondisk = False             # table mapped from path
+        self.qflushed = 0               # keys in qpath for reading
+        self.rbeg = 0                   # read buffer: keys rbeg ..
+        self.rbuf = ''
+        if resume and os.path.exists(path):
+            self.f = open(path, 'r+b')
+            clean = self.read_header()
+            qf = open(self.qpath, 'r+b')
+            qf.truncate(self.count * keylen)
+            qf.close()
+            self.qf = open(self.qpath, 'ab')
+            self.qflushed = self.count
+            self.open_table(clean)
+        else:
+            self.f = open(path, 'w+b')
+            self.qf = open(self.qpath, 'wb')
+            self.new_table(1024)
+        self.write_header(0)
+
+    # header
+
+    def write_header(self, clean):
+        hdr = struct.pack(hdr_fmt, hdr_magic, visited_format, self.keylen,
+                          self.capacity, self.count, self.done, self.nedge,
+                          clean)
+        hdr = hdr + struct.pack('<I', len(self.name)) + self.name
+        self.f.seek(0)
+        self.f.write(hdr)
+        self.f.flush()
+
+    def read_header(self):
+        "Read header of self.f, return its clean flag."
+        n = struct.calcsize(hdr_fmt)
+        self.f.seek(0)
+        hdr = self.f.read(n + 4)
+        if len(hdr) < n + 4:
+            raise Exception, "visited: %s: bad header" % self.path
+        magic, fmt, keylen, cap, count, done, nedge, clean = \
+            struct.unpack(hdr_fmt, hdr[:n])
+        name = self.f.read(struct.unpack('<I', hdr[n:])[0])
+        if magic.rstrip('\0') != hdr_magic or fmt != visited_format:
+            raise Exception, "visited: %s: not a visited table" % self.path
+        if keylen != self.keylen or name != self.name:
+            raise Exception, "visited: %s: for %s, %d byte keys" % \
+                (self.path, name, keylen)
+        self.capacity = cap
+        self.count = count
+        self.done = done
+        self.nedge = nedge
+        return clean
+
+    # table
+
+    def new_table(self, capacity):
+        "Make an empty table of capacity entries."
+        if self.mm: self.mm.close()
+        self.capacity = capacity
+        size = capacity * self.ewidth
+        if size <= self.ramsize:
+            self.ondisk = False
+            self.f.truncate(hdr_size)
+            self.mm = mmap.mmap(-1, size)
+        else:
+            # spill: truncate then extend gives zeros
+            self.ondisk = True
+            self.f.truncate(hdr_size)
+            self.f.truncate(hdr_size + size)
+            self.mm = mmap.mmap(self.f.fileno(), size, offset=hdr_size)
+
+    def open_table(self, clean):
+        "Open table of a resumed run, rebuilding it unless clean."
+        size = self.capacity * self.ewidth
+        if not clean:
+            cap = 1024
+            while 2*self.count > cap: cap = 2*cap
+            self.new_table(cap)
+            self.rehash()
+        elif size <= self.ramsize:
+            self.mm = mmap.mmap(-1, size)
+            self.f.seek(hdr_size)
+            self.mm.write(self.f.read(size))
+        else:
+            self.ondisk = True
+            self.mm = mmap.mmap(self.f.fileno(), size, offset=hdr_size)
+
+    def rehash(self):
+        "Insert keys 0 .. count-1 from qpath."
+        self.flush_queue()
+        keylen = self.keylen
+        qf = open(self.qpath, 'rb')
+        ix = 0
+        while ix < self.count:
+            buf = qf.read(min(self.count - ix, 4096) * keylen)
+            for b in range(0, len(buf), keylen):
+                key = buf[b:b+keylen]
+                self.put(self.probe(key)[0], ix, key)
+                ix = ix + 1
+        qf.close()
+
+    def probe(self, key):
+        "Return (offset of entry for key, its number or None)."
+        mm = self.mm
+        ew = self.ewidth
+        mask = self.capacity - 1
+        h = zlib.crc32(key) & mask
+        while True:
+            off = h * ew
+            n = struct.unpack('<I', mm[off:off+4])[0]
+            if n == 0: return off, None
+            if mm[off+4:off+ew] == key: return off, n - 1
+            h = (h + 1) & mask
+
+    def put(self, off, ix, key):
+        self.mm[off:off+self.ewidth] = struct.pack('<I', ix + 1) + key
+
+    def get(self, key):
+        return self.probe(key)[1]
+
+    def add(self, key):
+        off, ix = self.probe(key)
+        if ix != None: return ix, False
+        ix = self.count
+        self.put(off, ix, key)
+        self.qf.write(key)
+        self.count = ix + 1
+        if 2*self.count > self.capacity:
+            self.new_table(2*self.capacity)
+            self.rehash()
+        return ix, True
+
+    # queue
+
+    def flush_queue(self):
+        self.qf.flush()
+        self.qflushed = self.count
+
+    def key(self, ix):
+        "Return key numbered ix; reads ahead, for keys taken in order."
+        keylen = self.keylen
+        b = (ix - self.rbeg) * keylen
+        if b < 0 or b + keylen > len(self.rbuf):
+            if ix >= self.qflushed: self.flush_queue()
+            qf = open(self.qpath, 'rb')
+            qf.seek(ix * keylen)
+            self.rbuf = qf.read(4096 * keylen)
+            qf.close()
+            self.rbeg = ix
+            b = 0
+        return self.rbuf[b:b+keylen]
+
+    # checkpoints
+
+    def checkpoint(self, done, nedge):
+        "Sync keys, then record done and nedge for a resume."
+        self.flush_queue()
+        os.fsync(self.qf.fileno())
+        self.done = done
+        self.nedge = nedge
+        self.write_header(0)
+
+    def close(self, done, nedge):
+        self.checkpoint(done, nedge)
+        if self.ondisk:
+            self.mm.flush()
+        else:
+            self.f.seek(hdr_size)
+            self.f.write(self.mm[:])
+        self.mm.close()
+        self.mm = None
+        self.write_header(1)
+        self.f.close()
+        self.qf.close()
+
+    def disk_size(self):
+        "Bytes in path and qpath."
+        return os.path.getsize(self.path) + os.path.getsize(self.qpath)
+
+# --- last line of visited.py ---